@@ -1,46 +1,806 @@
+import re
+import time
+import random
 import aiohttp
+import base64
 import json
 import asyncio
+import hashlib
+import collections
+import bittensor as bt
 
-class HttpClient:
-    def __init__(self, base_url):
-        self.base_url = base_url
+from fractal.utils.shm import SharedMemoryRing, SlotOverwrittenError
+
+
+UNIX_SCHEME = "unix://"
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_TIMEOUT = 120
+DEFAULT_KEEPALIVE_TIMEOUT = 60
+
+# Responses are read and hashed in chunks of this size.
+STREAM_CHUNK_SIZE = 64 * 1024
+# Shared memory is base64 encoded in windows of this many bytes when only the digest is kept.
+SHM_ENCODE_WINDOW = 3 * 16 * 1024
+
+BALANCING_STRATEGIES = ["least_outstanding", "ewma"]
+# Weight of the newest sample in an endpoint's latency moving average.
+EWMA_ALPHA = 0.2
+# Number of recent latencies kept per endpoint for percentiles.
+LATENCY_WINDOW = 256
+# Hedging only starts once an endpoint has this many latency samples.
+HEDGE_MIN_SAMPLES = 20
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+DEFAULT_HEALTH_INTERVAL = 10
+HEALTH_TIMEOUT = 5
+
+
+class ModelClientError(Exception):
+    """Base class for requests to the model server that did not produce a completion."""
+
+
+class ModelConnectionError(ModelClientError):
+    """The model server could not be reached."""
+
+
+class ModelTimeoutError(ModelClientError):
+    """The model server did not answer in time."""
+
+
+class ModelServerError(ModelClientError):
+    """The model server answered with a non-200 status."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Model server returned status {status}: {message}")
+        self.status = status
+
+
+class ModelResponseError(ModelClientError):
+    """The model server answered with a body that is not a /generate response."""
+
+
+class ModelDeadlineError(ModelClientError):
+    """The request's deadline passed, or the model server dropped it because it could not finish in time."""
+
+
+class ModelUnavailableError(ModelClientError):
+    """Every model endpoint has an open circuit, so the request failed without being sent."""
+
+
+class ChunkedHasher:
+    """
+    sha256 of a whole stream plus one sha256 per `chunk_size` bytes of it, the digests a streamed challenge
+    is checked against chunk by chunk. Drop-in for `hashlib.sha256()` where only `update` and `hexdigest`
+    are used.
+    """
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.total = hashlib.sha256()
+        self.chunk = hashlib.sha256()
+        self.filled = 0
+        self.chunk_digests = []
+
+    def update(self, data):
+        self.total.update(data)
+        view = memoryview(data)
+        while len(view):
+            take = min(len(view), self.chunk_size - self.filled)
+            self.chunk.update(view[:take])
+            self.filled += take
+            view = view[take:]
+            if self.filled == self.chunk_size:
+                self.chunk_digests.append(self.chunk.hexdigest())
+                self.chunk = hashlib.sha256()
+                self.filled = 0
+
+    def hexdigest(self) -> str:
+        return self.total.hexdigest()
+
+    def finish(self) -> list:
+        """Closes the last, partial chunk and returns the digests of all chunks."""
+        if self.filled:
+            self.chunk_digests.append(self.chunk.hexdigest())
+            self.chunk = hashlib.sha256()
+            self.filled = 0
+        return self.chunk_digests
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of one endpoint. After `failure_threshold` consecutive failures the circuit opens and
+    requests fail fast. Once `reset_timeout` has passed a single trial request is let through (half open);
+    its outcome closes or re-opens the circuit. A successful health probe closes the circuit right away.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+
+    def available(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        # Half open: the trial request is still in flight.
+        return False
+
+    def acquire(self):
+        """Marks a request as sent; turns an expired open circuit into a half open one."""
+        if self.state == self.OPEN and self.available():
+            self.state = self.HALF_OPEN
+
+    def release(self):
+        """
+        Gives up a request that was cancelled before it finished. A cancelled trial request says nothing about
+        the endpoint, so a half open circuit goes back to open with its reset timeout already expired and the
+        next request becomes the trial.
+        """
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.trip()
+
+    def trip(self):
+        if self.state != self.OPEN:
+            self.trips += 1
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+
+
+class ModelEndpoint:
+    """
+    A single model server. Owns the session used to talk to it (a bounded, keep-alive connection pool opened
+    lazily inside the event loop that first uses it) and the load and latency statistics used for balancing.
+    """
+
+    def __init__(
+        self,
+        url,
+        pool_size=DEFAULT_POOL_SIZE,
+        timeout=DEFAULT_TIMEOUT,
+        keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout=DEFAULT_RESET_TIMEOUT,
+        health_interval=DEFAULT_HEALTH_INTERVAL,
+    ):
+        self.url = url
+        # A unix:///path/to/socket endpoint talks to a co-located model server over a unix domain socket and
+        # receives the video bytes through shared memory instead of base64 in the JSON body.
+        self.socket_path = None
+        self.base_url = url
+        if url.startswith(UNIX_SCHEME):
+            self.socket_path = url[len(UNIX_SCHEME):]
+            self.base_url = "http://localhost"
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
         self.session = None
+        self.loop = None
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.health_interval = health_interval
+        self.health_task = None
+        # Rendering profiles the server reported on its last successful health probe.
+        self.profiles = None
+
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.ewma_latency = None
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
 
     async def open_session(self):
-        if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
+        loop = asyncio.get_running_loop()
+        if self.session is not None and not self.session.closed and self.loop is loop:
+            return
+
+        # A session is bound to the loop it was created in; drop one left behind by another loop.
+        if self.session is not None and not self.session.closed:
+            bt.logging.warning(f"Model client session for {self.url} was opened in another event loop, reopening.")
+        if self.socket_path:
+            connector = aiohttp.UnixConnector(
+                path=self.socket_path, limit=self.pool_size, keepalive_timeout=self.keepalive_timeout
+            )
+        else:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size, keepalive_timeout=self.keepalive_timeout, enable_cleanup_closed=True
+            )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"Content-Type": "application/json"},
+        )
+        self.loop = loop
+        if self.health_interval:
+            self.health_task = loop.create_task(self.probe_health())
 
     async def close_session(self):
+        if self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
         if self.session and not self.session.closed:
             await self.session.close()
+        self.session = None
+
+    async def check_health(self) -> bool:
+        try:
+            async with self.session.get(
+                f"{self.base_url}/health", timeout=aiohttp.ClientTimeout(total=HEALTH_TIMEOUT)
+            ) as response:
+                if response.status != 200:
+                    return False
+                health = await response.json(content_type=None)
+                if isinstance(health, dict) and health.get("profiles"):
+                    self.profiles = list(health["profiles"])
+                return True
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return False
+
+    async def probe_health(self):
+        """
+        Probes /health every `health_interval` seconds. A failed probe opens the circuit straight away so
+        requests stop waiting on a dead server; a successful one closes it again.
+        """
+        while True:
+            await asyncio.sleep(self.health_interval)
+            if self.session is None or self.session.closed:
+                return
+            healthy = await self.check_health()
+            if healthy and self.breaker.state != CircuitBreaker.CLOSED:
+                bt.logging.info(f"Model endpoint {self.url} is healthy again, closing circuit.")
+                self.breaker.record_success()
+            elif not healthy and self.breaker.state != CircuitBreaker.OPEN:
+                bt.logging.warning(f"Model endpoint {self.url} failed its health check, opening circuit.")
+                self.breaker.trip()
+
+    def close(self):
+        """
+        Closes the session from synchronous code by running `close_session` in the event loop that owns it.
+        """
+        if self.session is None or self.session.closed or self.loop is None or self.loop.is_closed():
+            return
+        try:
+            if self.loop.is_running():
+                asyncio.run_coroutine_threadsafe(self.close_session(), self.loop).result(timeout=5)
+            else:
+                self.loop.run_until_complete(self.close_session())
+        except Exception as e:
+            bt.logging.warning(f"Failed to close model client session for {self.url}: {e}")
+
+    def record(self, latency: float, success: bool, unhealthy: bool = True):
+        """
+        Records the outcome of a request. Failures that say nothing about the endpoint's health, such as a
+        rejected request, pass `unhealthy=False` and leave the circuit alone.
+        """
+        self.requests += 1
+        if not success:
+            self.errors += 1
+            if unhealthy:
+                self.breaker.record_failure()
+            return
+        self.breaker.record_success()
+        self.latencies.append(latency)
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma_latency
+
+    def latency_percentile(self, q: float):
+        """Returns the q-th percentile of recent successful latencies, or None without enough samples."""
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(q / 100 * len(latencies)))]
+
+    def stats(self) -> dict:
+        return {
+            "circuit": self.breaker.state,
+            "circuit_trips": self.breaker.trips,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "ewma_latency": self.ewma_latency,
+            "p50_latency": self.latency_percentile(50),
+            "p95_latency": self.latency_percentile(95),
+        }
+
+
+class HttpClient:
+    """
+    Client for one or more model servers.
+
+    Every request goes to the endpoint picked by `strategy`: the one with the fewest requests in flight
+    ("least_outstanding") or the lowest expected wait, its latency moving average scaled by its queue ("ewma").
+    With `hedge_percentile` set and more than one endpoint, a request that is still running after that
+    percentile of its endpoint's recent latencies is duplicated on a second endpoint; the first answer wins
+    and the other request is cancelled.
+    """
+
+    def __init__(
+        self,
+        endpoints,
+        pool_size=DEFAULT_POOL_SIZE,
+        timeout=DEFAULT_TIMEOUT,
+        keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+        strategy="least_outstanding",
+        hedge_percentile=None,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout=DEFAULT_RESET_TIMEOUT,
+        health_interval=DEFAULT_HEALTH_INTERVAL,
+    ):
+        # Accept a single url, a comma separated list of urls or a list of urls.
+        if isinstance(endpoints, str):
+            endpoints = endpoints.split(",")
+        endpoints = [url.strip() for url in endpoints if url.strip()]
+        if not endpoints:
+            raise ValueError("At least one model endpoint is required.")
+        if strategy not in BALANCING_STRATEGIES:
+            raise ValueError(f"Invalid balancing strategy: {strategy}")
+
+        self.endpoints = [
+            ModelEndpoint(
+                url,
+                pool_size=pool_size,
+                timeout=timeout,
+                keepalive_timeout=keepalive_timeout,
+                failure_threshold=failure_threshold,
+                reset_timeout=reset_timeout,
+                health_interval=health_interval,
+            )
+            for url in endpoints
+        ]
+        self.strategy = strategy
+        self.hedge_percentile = hedge_percentile or None
+        self.rings = {}
+
+    async def close_session(self):
+        for endpoint in self.endpoints:
+            await endpoint.close_session()
 
-    async def generate(self, text, seed, **kwargs):
-        await self.open_session()  # Ensure session is open and ready to use
-        url = f"{self.base_url}/generate"
+    def close(self):
+        """
+        Closes all sessions from synchronous code, e.g. a neuron's shutdown path.
+        """
+        for endpoint in self.endpoints:
+            endpoint.close()
+
+    def stats(self) -> dict:
+        """Returns the load and latency statistics of every endpoint, keyed by url."""
+        return {endpoint.url: endpoint.stats() for endpoint in self.endpoints}
+
+    def profiles(self) -> list:
+        """
+        Returns the rendering profiles at least one healthy endpoint supports, as last reported by their health
+        probes. Endpoints that did not report any are assumed to support the default profile only.
+        """
+        profiles = set()
+        for endpoint in self.endpoints:
+            if endpoint.breaker.available():
+                profiles.update(endpoint.profiles or ["default"])
+        return sorted(profiles)
+
+    def select(self, exclude=None) -> ModelEndpoint:
+        """
+        Picks the endpoint for the next request among those whose circuit lets requests through.
+
+        Raises:
+            ModelUnavailableError: If no such endpoint exists.
+        """
+        candidates = [
+            endpoint for endpoint in self.endpoints
+            if endpoint is not exclude and endpoint.breaker.available()
+        ]
+        if not candidates:
+            raise ModelUnavailableError("No healthy model endpoint available.")
+
+        if self.strategy == "ewma":
+            # Endpoints without samples yet look free so they get explored.
+            def cost(endpoint):
+                return (endpoint.ewma_latency or 0.0) * (endpoint.outstanding + 1)
+        else:
+            def cost(endpoint):
+                return endpoint.outstanding
+
+        lowest = min(cost(endpoint) for endpoint in candidates)
+        return random.choice([endpoint for endpoint in candidates if cost(endpoint) == lowest])
+
+    def read_shared_memory(self, descriptor, hasher=None, keep_completion=True):
+        """
+        Reads a completion the model server left in shared memory and returns it base64 encoded, which is
+        what the synapse carries. The video is encoded straight out of the mapping without an intermediate copy,
+        window by window when only the digest is wanted.
+        """
+        name = descriptor["name"]
+        if name not in self.rings:
+            self.rings[name] = SharedMemoryRing(name=name)
+        ring = self.rings[name]
+
+        view = ring.view(descriptor)
+        try:
+            if keep_completion:
+                completion = base64.b64encode(view).decode("ascii")
+                if hasher is not None:
+                    hasher.update(completion.encode("ascii"))
+            else:
+                completion = None
+                # Windows are a multiple of 3 bytes so the encoded windows concatenate to the full encoding.
+                for start in range(0, len(view), SHM_ENCODE_WINDOW):
+                    hasher.update(base64.b64encode(view[start:start + SHM_ENCODE_WINDOW]))
+        finally:
+            view.release()
+        ring.check(descriptor)
+        return completion
+
+    async def read_completion(self, response, hasher, keep_completion=True):
+        """
+        Reads the completion out of a /generate response chunk by chunk, feeding every chunk to `hasher`.
+        Only the chunks are held in memory, and not even those when `keep_completion` is False.
+        """
+        stream = _CompletionStream()
+        parts = [] if keep_completion else None
+        async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+            for piece in stream.feed(chunk):
+                hasher.update(piece)
+                if keep_completion:
+                    parts.append(piece)
+
+        if not stream.found:
+            # Small bodies without a completion field point at shared memory instead.
+            response_json = json.loads(bytes(stream.head))
+            if "shm" in response_json:
+                return self.read_shared_memory(response_json["shm"], hasher, keep_completion)
+            return "" if keep_completion else None
+
+        return b"".join(parts).decode("ascii") if keep_completion else None
+
+    async def request(
+        self, endpoint, text, seed, keep_completion=True, timeout=None, deadline=None, hasher=None, **kwargs
+    ):
+        """
+        Sends one /generate request to `endpoint` and hashes the completion while it is downloaded.
+
+        `deadline` is a `time.monotonic()` timestamp. What is left of it is sent to the model server as the
+        request's budget and caps the request timeout. `hasher` replaces the sha256 the completion is fed to.
+
+        Returns:
+            Tuple[Optional[str], str]: The completion (None unless `keep_completion`) and its sha256 hex digest.
+
+        Raises:
+            ModelClientError: A subclass describing why no completion was produced.
+        """
+        await endpoint.open_session()  # Ensure session is open and ready to use
+        url = f"{endpoint.base_url}/generate"
         data = {"text": text, "seed": seed}
+        if endpoint.socket_path:
+            data["transport"] = "shm"
         data.update(kwargs)  # Allows for additional parameters if needed
-        headers = {"Content-Type": "application/json"}
 
+        capped = False
+        if deadline is not None:
+            budget = deadline - time.monotonic()
+            if budget <= 0:
+                raise ModelDeadlineError(f"{endpoint.url}: deadline passed {-budget:.1f}s before sending")
+            data["budget"] = budget
+            if budget < (timeout if timeout is not None else endpoint.timeout):
+                timeout, capped = budget, True
+        # Only override the session timeout when asked to; aiohttp treats timeout=None as "no timeout".
+        request_kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout is not None else {}
+
+        hasher = hasher if hasher is not None else hashlib.sha256()
+        start_time = time.monotonic()
+        endpoint.breaker.acquire()
+        endpoint.outstanding += 1
         try:
-            async with self.session.post(url, data=json.dumps(data), headers=headers) as response:
-                if response.status == 200:
-                    response_json = await response.json()
-                    completion_text = response_json.get('completion', '')  
-                    return completion_text
-                elif response.status == 500:
-                    # Handle server error
-                    return 'Server error occurred'
-                else:
-                    # Handle other non-successful statuses
-                    return f'Error: received status code {response.status}'
+            async with endpoint.session.post(url, data=json.dumps(data), **request_kwargs) as response:
+                if response.status == 408:
+                    raise ModelDeadlineError(f"{endpoint.url}: {await response.text()}")
+                if response.status != 200:
+                    raise ModelServerError(response.status, await response.text())
+                completion = await self.read_completion(response, hasher, keep_completion)
+
+        except ModelServerError as e:
+            # Only server side failures count against the endpoint, not requests it rejected.
+            endpoint.record(time.monotonic() - start_time, success=False, unhealthy=e.status >= 500)
+            raise
+
+        # Handle the model server dropping the request because it could not make the deadline
+        except ModelDeadlineError:
+            endpoint.record(time.monotonic() - start_time, success=False, unhealthy=False)
+            raise
 
         # Handle client-side errors (e.g., connection issues)
         except aiohttp.ClientError as e:
-            return f'Client error occurred: {str(e)}'
+            endpoint.record(time.monotonic() - start_time, success=False)
+            raise ModelConnectionError(f"{endpoint.url}: {e}") from e
 
         # Handle timeout error
-        except asyncio.TimeoutError:
-            return 'Request timed out'
+        except asyncio.TimeoutError as e:
+            # Running out of the caller's budget is not the endpoint's fault.
+            endpoint.record(time.monotonic() - start_time, success=False, unhealthy=not capped)
+            if capped:
+                raise ModelDeadlineError(f"{endpoint.url}: deadline passed while waiting") from e
+            raise ModelTimeoutError(f"{endpoint.url}: request timed out") from e
+
+        # Handle the model server reusing the shared memory slot before we read it
+        except SlotOverwrittenError as e:
+            endpoint.record(time.monotonic() - start_time, success=False, unhealthy=False)
+            raise ModelResponseError(f"{endpoint.url}: {e}") from e
+
+        # Handle a body that does not look like a /generate response
+        except ValueError as e:
+            endpoint.record(time.monotonic() - start_time, success=False)
+            raise ModelResponseError(f"{endpoint.url}: malformed response: {e}") from e
+
+        # Handle the caller giving up, e.g. a hedged request losing the race
+        except asyncio.CancelledError:
+            endpoint.breaker.release()
+            raise
+
+        finally:
+            endpoint.outstanding -= 1
+
+        endpoint.record(time.monotonic() - start_time, success=True)
+        return completion, hasher.hexdigest()
+
+    async def generate_with_hash(self, text, seed, keep_completion=True, timeout=None, budget=None, **kwargs):
+        """
+        Requests a completion from the selected endpoint, hedging on a second one when configured, and
+        hashes it while it is downloaded.
+
+        `budget` is the number of seconds the caller can still wait. It is forwarded to the model server as a
+        deadline so the server can order its queue and drop work that cannot finish in time.
+
+        Returns:
+            Tuple[Optional[str], str]: The completion (None unless `keep_completion`) and its sha256 hex digest,
+            equal to `hashing_function(completion)`.
+
+        Raises:
+            ModelClientError: If no endpoint produced a completion. `ModelUnavailableError` is raised without
+            sending anything when every endpoint's circuit is open, `ModelDeadlineError` when the budget ran out.
+        """
+        deadline = time.monotonic() + budget if budget is not None else None
+        primary = self.select()
+        first = asyncio.ensure_future(
+            self.request(primary, text, seed, keep_completion, timeout, deadline, **kwargs)
+        )
+
+        hedge_delay = primary.latency_percentile(self.hedge_percentile) if self.hedge_percentile else None
+        if hedge_delay is None or len(self.endpoints) < 2:
+            return await first
+
+        tasks = {first: primary}
+        try:
+            done, _ = await asyncio.wait([first], timeout=hedge_delay)
+            if not done:
+                try:
+                    secondary = self.select(exclude=primary)
+                except ModelUnavailableError:
+                    return await first
+                secondary.hedges += 1
+                tasks[asyncio.ensure_future(
+                    self.request(secondary, text, seed, keep_completion, timeout, deadline, **kwargs)
+                )] = secondary
+
+            # Take the first successful answer, or raise the last failure if neither succeeds.
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda task: task.exception() is not None):
+                    if task.exception() is not None:
+                        if not pending:
+                            raise task.exception()
+                        continue
+                    if tasks[task] is not primary:
+                        tasks[task].hedge_wins += 1
+                    return task.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def generate_chunk_digests(self, text, seed, chunk_size, timeout=None, budget=None, **kwargs):
+        """
+        Requests a completion without keeping it and returns its sha256 hex digest along with the digest of
+        every `chunk_size` characters of it, to check a streamed answer chunk by chunk. Not hedged.
+
+        Returns:
+            Tuple[str, List[str]]: The digest of the completion and the digests of its chunks.
+        """
+        deadline = time.monotonic() + budget if budget is not None else None
+        hasher = ChunkedHasher(chunk_size)
+        _, digest = await self.request(
+            self.select(), text, seed, False, timeout, deadline, hasher=hasher, **kwargs
+        )
+        return digest, hasher.finish()
+
+    async def generate_many(self, jobs, timeout=None, budget=None):
+        """
+        Sends a batch of jobs to one endpoint in a single /generate_batch request and yields the results as the
+        model server finishes them, which is not necessarily in the order of `jobs`.
+
+        Args:
+            jobs: (text, seed) or (text, seed, profile) tuples.
+            timeout: Timeout in seconds for the whole batch.
+            budget: Seconds the caller can still wait, shared by every job.
+
+        Yields:
+            Tuple[int, Union[str, ModelClientError]]: The index of the job in `jobs` and its completion, or the
+            error it failed with. Jobs the stream ended without are yielded with a `ModelResponseError`.
+
+        Raises:
+            ModelClientError: If the batch could not be sent or was cut short; `ModelDeadlineError` when the
+            budget ran out.
+        """
+        jobs = [
+            {"text": job[0], "seed": job[1], "profile": job[2] if len(job) > 2 else "default"}
+            for job in jobs
+        ]
+        if not jobs:
+            return
+
+        endpoint = self.select()
+        await endpoint.open_session()
+        data = {"jobs": jobs}
+        if endpoint.socket_path:
+            data["transport"] = "shm"
+        capped = False
+        if budget is not None:
+            if budget <= 0:
+                raise ModelDeadlineError(f"{endpoint.url}: deadline passed {-budget:.1f}s before sending")
+            data["budget"] = budget
+            if budget < (timeout if timeout is not None else endpoint.timeout):
+                timeout, capped = budget, True
+        request_kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout is not None else {}
+
+        start_time = time.monotonic()
+        remaining = set(range(len(jobs)))
+        endpoint.breaker.acquire()
+        endpoint.outstanding += len(jobs)
+        try:
+            async with endpoint.session.post(
+                f"{endpoint.base_url}/generate_batch", data=json.dumps(data), **request_kwargs
+            ) as response:
+                if response.status != 200:
+                    raise ModelServerError(response.status, await response.text())
+
+                # Lines carry whole videos, far beyond what StreamReader.readline accepts, so split by hand.
+                buffer = bytearray()
+                async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    buffer += chunk
+                    while True:
+                        end = buffer.find(b"\n")
+                        if end == -1:
+                            break
+                        line = bytes(buffer[:end])
+                        del buffer[:end + 1]
+                        index, result = self.read_batch_result(endpoint, line)
+                        remaining.discard(index)
+                        endpoint.outstanding -= 1
+                        yield index, result
+
+        except ModelServerError as e:
+            endpoint.record(time.monotonic() - start_time, success=False, unhealthy=e.status >= 500)
+            raise
+
+        except aiohttp.ClientError as e:
+            endpoint.record(time.monotonic() - start_time, success=False)
+            raise ModelConnectionError(f"{endpoint.url}: {e}") from e
+
+        except asyncio.TimeoutError as e:
+            # As for single requests, running out of the caller's budget is not the endpoint's fault.
+            endpoint.record(time.monotonic() - start_time, success=False, unhealthy=not capped)
+            if capped:
+                raise ModelDeadlineError(f"{endpoint.url}: deadline passed while waiting for the batch") from e
+            raise ModelTimeoutError(f"{endpoint.url}: batch timed out") from e
+
+        except ValueError as e:
+            endpoint.record(time.monotonic() - start_time, success=False)
+            raise ModelResponseError(f"{endpoint.url}: malformed batch response: {e}") from e
+
+        # The caller was cancelled or stopped reading the batch
+        except (asyncio.CancelledError, GeneratorExit):
+            endpoint.breaker.release()
+            raise
+
+        finally:
+            endpoint.outstanding -= len(remaining)
+
+        for index in sorted(remaining):
+            yield index, ModelResponseError(f"{endpoint.url}: batch ended without job {index}")
+
+    def read_batch_result(self, endpoint, line):
+        """
+        Decodes one line of a /generate_batch response into the job index and its completion or error, and
+        records the outcome against `endpoint`. Latencies of batched jobs include their wait behind the rest
+        of the batch, so they are not recorded.
+        """
+        result = json.loads(line)
+        index = result["index"]
+        if "status" in result:
+            status = result["status"]
+            endpoint.record(0, success=False, unhealthy=status >= 500)
+            if status == 408:
+                return index, ModelDeadlineError(f"{endpoint.url}: {result.get('detail')}")
+            return index, ModelServerError(status, result.get("detail", ""))
+
+        try:
+            if "shm" in result:
+                completion = self.read_shared_memory(result["shm"])
+            else:
+                completion = result["completion"]
+        except SlotOverwrittenError as e:
+            endpoint.record(0, success=False, unhealthy=False)
+            return index, ModelResponseError(f"{endpoint.url}: {e}")
+
+        endpoint.requests += 1
+        endpoint.breaker.record_success()
+        return index, completion
+
+    async def generate(self, text, seed, timeout=None, budget=None, **kwargs):
+        """
+        Requests a completion and returns it.
+
+        Raises:
+            ModelClientError: If no endpoint produced a completion.
+        """
+        completion, _ = await self.generate_with_hash(text, seed, timeout=timeout, budget=budget, **kwargs)
+        return completion
+
+
+class _CompletionStream:
+    """
+    Incremental scanner for the `completion` string of a /generate JSON body. The value is base64, so it
+    contains neither quotes nor escapes and can be passed on verbatim as the body streams in.
+    """
+
+    START = re.compile(rb'"completion"\s*:\s*"')
+    MAX_HEAD = 64 * 1024
+
+    def __init__(self):
+        self.head = bytearray()
+        self.found = False
+        self.done = False
 
+    def feed(self, chunk: bytes):
+        if self.done:
+            return
+        if not self.found:
+            self.head += chunk
+            match = self.START.search(self.head)
+            if match is None:
+                if len(self.head) > self.MAX_HEAD:
+                    raise ValueError("no completion field in the first 64KB of the response")
+                return
+            self.found = True
+            chunk = bytes(self.head[match.end():])
+            self.head.clear()
 
+        end = chunk.find(b'"')
+        if end != -1:
+            self.done = True
+            chunk = chunk[:end]
+        if b"\\" in chunk:
+            raise ValueError("unexpected escape sequence in completion")
+        if chunk:
+            yield chunk
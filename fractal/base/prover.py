@@ -28,7 +28,10 @@ import traceback
 import bittensor as bt
 from fractal.base.neuron import BaseNeuron
 from fractal.utils.config import add_prover_args
-from bittensor.axon import FastAPIThreadedServer
+from fractal.prover.snapshot import MetagraphSnapshot
+from fractal.prover.workers import AxonWorkers
+from fractal.prover.telemetry import Telemetry, REQUEST_TIMINGS
+from fractal.utils.handoff import DRAIN_TIMEOUT, SocketServer, listening_socket, restart
 
 
 class BaseProverNeuron(BaseNeuron):
@@ -55,6 +58,13 @@ class BaseProverNeuron(BaseNeuron):
                 "You are allowing non-registered entities to send requests to your prover. This is a security risk."
             )
 
+        # Lookup tables for the blacklist and priority hooks, replaced on every metagraph resync.
+        self.snapshot = MetagraphSnapshot.from_metagraph(self.metagraph)
+        # Set by run() when the axon is served from several processes.
+        self.workers = None
+        # The axon's listening socket in single process mode, kept open across restarts.
+        self.listen_socket = None
+
         # The axon handles request processing, allowing verifiers to send this prover requests.
         self.axon = bt.axon(wallet=self.wallet, config=self.config)
 
@@ -67,6 +77,10 @@ class BaseProverNeuron(BaseNeuron):
         )
         bt.logging.info(f"Axon created: {self.axon}")      
 
+        # Request latency histograms; added last, the timing middleware wraps the whole axon.
+        self.telemetry = Telemetry()
+        self.axon.app.middleware("http")(self.time_request)
+
         try:
             self.loop = asyncio.get_event_loop()
         except RuntimeError as e:
@@ -117,15 +131,21 @@ class BaseProverNeuron(BaseNeuron):
         self.axon.serve(netuid=self.config.netuid, subtensor=self.subtensor)
 
         # Start  starts the prover's axon, making it active on the network.
+        if self.config.neuron.axon_workers > 1:
+            # Already forked when run in a background thread.
+            self.start_workers()
+        else:
+            # change the config in the axon
+            log_level = "trace" if bt.logging.__trace_on__ else "critical"
+            fast_config = uvicorn.Config(
+                self.axon.app, host="0.0.0.0", port=self.config.axon.port, log_level=log_level, loop="asyncio"
+            )
+            self.listen_socket = listening_socket("0.0.0.0", self.config.axon.port)
+            self.axon.fast_server = SocketServer(config=fast_config, sock=self.listen_socket)
 
-        # change the config in the axon
-        log_level = "trace" if bt.logging.__trace_on__ else "critical"
-        fast_config = uvicorn.Config(
-            self.axon.app, host="0.0.0.0", port=self.config.axon.port, log_level=log_level, loop="asyncio"
-        )
-        self.axon.fast_server = FastAPIThreadedServer(config=fast_config)
-
-        self.axon.start()
+            self.axon.start()
+            if self.config.neuron.metrics_port:
+                self.telemetry.serve(self.config.neuron.metrics_port)
 
 
 
@@ -140,6 +160,8 @@ class BaseProverNeuron(BaseNeuron):
                 ):
                     # Wait before checking again.
                     time.sleep(1)
+                    if threading.current_thread() is threading.main_thread():
+                        self.check_workers()
 
                     # Check if we should exit.
                     if self.should_exit:
@@ -151,7 +173,7 @@ class BaseProverNeuron(BaseNeuron):
 
         # If someone intentionally stops the prover, it'll safely terminate operations.
         except KeyboardInterrupt:
-            self.axon.stop()
+            self.shutdown()
             bt.logging.success("Prover killed by keyboard interrupt.")
             exit()
 
@@ -159,12 +181,35 @@ class BaseProverNeuron(BaseNeuron):
         except Exception as e:
             bt.logging.error(traceback.format_exc())
 
+    def start_workers(self):
+        """
+        Forks the axon worker processes when configured. Only the forking thread lives on in a child, so this
+        runs on the main thread before the background thread starts.
+        """
+        if self.config.neuron.axon_workers > 1 and self.workers is None:
+            bt.logging.info(f"Serving the axon from {self.config.neuron.axon_workers} worker processes.")
+            self.workers = AxonWorkers(self, self.config.neuron.axon_workers)
+            self.workers.start()
+
+    def check_workers(self):
+        """Restarts axon workers that died. Forks, so call it from the main thread."""
+        if self.workers is not None:
+            self.workers.check()
+
+    def prepare_worker(self, index: int, num_workers: int):
+        """
+        Runs in axon worker `index` of `num_workers` before it serves. A worker only serves; supervising is
+        the parent's job. Subclasses split per-process limits between the workers here.
+        """
+        self.workers = None
+
     def run_in_background_thread(self):
         """
         Starts the prover's operations in a separate background thread.
         This is useful for non-blocking operations.
         """
         if not self.is_running:
+            self.start_workers()
             bt.logging.debug("Starting prover in background thread.")
             self.should_exit = False
             self.thread = threading.Thread(target=self.run, daemon=True)
@@ -182,6 +227,91 @@ class BaseProverNeuron(BaseNeuron):
             self.thread.join(5)
             self.is_running = False
             bt.logging.debug("Stopped")
+        self.shutdown()
+
+    def shutdown(self):
+        """
+        Stops the axon and releases the resources held by the prover. Subclasses owning further resources,
+        such as the model client, extend this.
+        """
+        if self.workers is not None:
+            self.workers.stop()
+            self.workers = None
+        else:
+            self.axon.stop()
+        self.telemetry.stop()
+
+    def handoff(self):
+        """
+        Restarts into the updated code without refusing or dropping requests.
+
+        With axon workers the new image starts its own workers next to the old ones, which keep serving and
+        are told to drain once the new ones accept requests. Otherwise the axon stops accepting, answers
+        the requests in flight and the listening socket is carried over the exec; requests arriving in the
+        meantime wait in its backlog.
+        """
+        bt.logging.info("Handing over to the updated prover.")
+        if self.workers is not None:
+            # The new image publishes its snapshots in a segment of its own.
+            self.workers.shared.close()
+            # Orphaned by the exec, the old workers stay our children: the pid does not change.
+            restart(drain_pids=list(self.workers.pids))
+
+        self.axon.stop()
+        if isinstance(self.axon.fast_server, SocketServer):
+            if not self.axon.fast_server.stopped.wait(DRAIN_TIMEOUT):
+                bt.logging.warning("Requests still in flight after the drain timeout, restarting anyway.")
+        self.shutdown()
+        restart(listen_socket=self.listen_socket)
+
+    def remaining_budget(self, synapse: bt.Synapse) -> float:
+        """
+        Returns how many seconds are left before the verifier gives up on `synapse`, less the margin kept for
+        sending the response back.
+
+        The dendrite stamps its nonce when it sends the request. It is only trusted as a send time when it
+        falls within the request's timeout of our clock; otherwise (clock skew, monotonic nonces) the request
+        is assumed to have just arrived.
+        """
+        timeout = synapse.timeout or 12.0
+        elapsed = self.time_since_sent(synapse) or 0.0
+        return timeout - elapsed - self.config.neuron.deadline_margin
+
+    def time_since_sent(self, synapse: bt.Synapse):
+        """
+        Seconds since the dendrite stamped its nonce on `synapse`, or None if the nonce cannot be read as a
+        send time on our clock.
+        """
+        nonce = getattr(synapse.dendrite, "nonce", None)
+        if not nonce:
+            return None
+        since_sent = (time.time_ns() - nonce) / 1e9
+        return since_sent if 0 <= since_sent <= (synapse.timeout or 12.0) else None
+
+    def caller_label(self, hotkey: str) -> str:
+        """The hotkey to file metrics under; unregistered callers share one label to bound cardinality."""
+        return hotkey if self.snapshot.is_registered(hotkey) else "unregistered"
+
+    async def time_request(self, request, call_next):
+        """
+        Axon middleware recording the time a request spends in the axon outside the forward handler, which
+        reports its own duration through `REQUEST_TIMINGS`.
+        """
+        timings = {}
+        token = REQUEST_TIMINGS.set(timings)
+        start = time.perf_counter()
+        try:
+            return await call_next(request)
+        finally:
+            REQUEST_TIMINGS.reset(token)
+            if "forward" in timings:
+                total = time.perf_counter() - start
+                self.telemetry.observe(
+                    "serialize",
+                    request.url.path.strip("/"),
+                    self.caller_label(request.headers.get("bt_header_dendrite_hotkey", "")),
+                    max(total - timings["forward"], 0.0),
+                )
 
     def __enter__(self):
         """
@@ -223,6 +353,16 @@ class BaseProverNeuron(BaseNeuron):
 
         # Sync the metagraph.
         self.metagraph.sync(subtensor=self.subtensor)
+        self.update_snapshot(MetagraphSnapshot.from_metagraph(self.metagraph))
+        if self.workers is not None:
+            self.workers.publish(self.snapshot)
+
+    def update_snapshot(self, snapshot: MetagraphSnapshot):
+        """
+        Replaces the lookup tables of the blacklist and priority hooks, after a resync or, in an axon worker,
+        when the parent published a new snapshot. Subclasses drop per-caller state of deregistered hotkeys here.
+        """
+        self.snapshot = snapshot
 
     def save_state(self):
         if not self.config.disable_autoupdate:
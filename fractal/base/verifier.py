@@ -34,6 +34,7 @@ from substrateinterface.base import SubstrateInterface
 from fractal.mock import MockDendrite
 from fractal.base.neuron import BaseNeuron
 from fractal.utils.config import add_verifier_args
+from fractal.utils.handoff import DRAIN_TIMEOUT, restart
 
 
 class BaseVerifierNeuron(BaseNeuron):
@@ -187,7 +188,7 @@ class BaseVerifierNeuron(BaseNeuron):
 
         # If someone intentionally stops the verifier, it'll safely terminate operations.
         except KeyboardInterrupt:
-            self.axon.stop()
+            self.shutdown()
             bt.logging.success("Verifier killed by keyboard interrupt.")
             sys.exit()
 
@@ -220,6 +221,28 @@ class BaseVerifierNeuron(BaseNeuron):
             self.is_running = False
             bt.logging.debug("Stopped")
 
+    def handoff(self):
+        """
+        Restarts into the updated code once the forward step in progress has finished, saving the scores
+        first so the new process picks up where this one stopped.
+        """
+        bt.logging.info("Finishing the current step before handing over to the updated verifier.")
+        if self.is_running:
+            self.should_exit = True
+            self.thread.join(DRAIN_TIMEOUT)
+            self.is_running = False
+        self.save_state()
+        self.shutdown()
+        restart()
+
+    def shutdown(self):
+        """
+        Stops the axon and releases the resources held by the verifier. Subclasses owning further resources,
+        such as the model client, extend this.
+        """
+        if hasattr(self, "axon"):
+            self.axon.stop()
+
     def __enter__(self):
         self.run()
         return self
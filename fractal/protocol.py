@@ -19,6 +19,8 @@
 import pydantic
 import bittensor as bt
 import random
+import asyncio
+from aiohttp import ClientResponse
 from typing import List, Optional
 
 class InferenceeSamplingParams(pydantic.BaseModel):
@@ -43,7 +45,132 @@ class ChallengeSamplingParams(pydantic.BaseModel):
 
 
 
-class Inference(bt.Synapse):
+# Characters of the base64 completion per chunk digest. A multiple of 4, so every chunk decodes on its own.
+STREAM_CHUNK_CHARS = 65536
+
+# Bytes of video per streamed chunk: exactly one STREAM_CHUNK_CHARS chunk of the base64 completion, so a
+# streamed chunk re-encodes to the chunk its digest was computed over.
+STREAM_CHUNK_BYTES = STREAM_CHUNK_CHARS // 4 * 3
+
+
+class StreamingVideoSynapse(bt.StreamingSynapse):
+    """
+    Base for synapses whose video is streamed back as raw bytes in `chunk_size` byte chunks instead of as
+    base64 inside a JSON body, a quarter fewer bytes on the wire and no JSON encoding on either side.
+    `process_streaming_response` reads the chunks off the connection and yields them one at a time, so a
+    receiver can hash and check each chunk as it arrives and stop reading at the first bad one without
+    holding the whole video.
+
+    A prover that cannot serve the request streams nothing.
+    """
+    query: str = pydantic.Field(
+        ...,
+        title="Query",
+        description="The query to be sent to the Bittensor network.",
+    )
+
+    sampling_params: ChallengeSamplingParams = pydantic.Field(
+        ...,
+        title="Sampling Params",
+        description="The sampling parameters for the TGI model. `Inference` has its own.",
+    )
+
+    chunk_size: int = pydantic.Field(
+        STREAM_CHUNK_BYTES,
+        title="Chunk Size",
+        description="Bytes of video per streamed chunk.",
+    )
+
+    required_hash_fields: Optional[List[str]] = pydantic.Field(
+        default_factory=lambda: ["query", "sampling_params"],
+        title="Required Hash Fields",
+        description="A list of fields that are required for the hash.",
+        allow_mutation=False,
+    )
+
+    async def process_streaming_response(self, response: ClientResponse):
+        while True:
+            try:
+                yield await response.content.readexactly(self.chunk_size)
+            except asyncio.IncompleteReadError as e:
+                # The last chunk is short, or the stream ended.
+                if e.partial:
+                    yield e.partial
+                return
+
+    def extract_response_json(self, response: ClientResponse) -> dict:
+        headers = {
+            k.decode("utf-8"): v.decode("utf-8")
+            for k, v in response.__dict__["_raw_headers"]
+        }
+
+        def extract_info(prefix):
+            return {
+                key.split("_")[-1]: value
+                for key, value in headers.items()
+                if key.startswith(prefix)
+            }
+
+        return {
+            "name": headers.get("name", ""),
+            "timeout": float(headers.get("timeout", 0)),
+            "total_size": int(headers.get("total_size", 0)),
+            "header_size": int(headers.get("header_size", 0)),
+            "dendrite": extract_info("bt_header_dendrite"),
+            "axon": extract_info("bt_header_axon"),
+            "query": self.query,
+            "sampling_params": self.sampling_params,
+            "chunk_size": self.chunk_size,
+        }
+
+
+class Inference(StreamingVideoSynapse):
+    """
+    Inference streams a generated video back to the caller in chunks. The chunks are also collected as they
+    arrive, since an inference caller wants the video itself; `video()` returns it without copying.
+
+    Attributes:
+
+    - `query` (str): The query to be sent to the Bittensor network. Immutable.
+
+    - `sampling_params` (InferenceeSamplingParams): The sampling parameters, including the seed. Immutable.
+
+    - `required_hash_fields` (Optional[List[str]]): A list of fields that are required for the hash.
+    """
+    sampling_params: InferenceeSamplingParams = pydantic.Field(
+        ...,
+        title="Sampling Params",
+        description="The sampling parameters for the TGI model.",
+    )
+
+    _video: bytearray = pydantic.PrivateAttr(default_factory=bytearray)
+
+    async def process_streaming_response(self, response: ClientResponse):
+        async for chunk in super().process_streaming_response(response):
+            self._video += chunk
+            yield chunk
+
+    def video(self) -> memoryview:
+        """The raw video bytes received so far."""
+        return memoryview(self._video)
+
+
+class StreamingChallenge(StreamingVideoSynapse):
+    """
+    StreamingChallenge is the streamed form of `Challenge`, used by the verifier to fetch a full payload. It
+    checks every chunk against the digests of its own ground truth as it arrives and hangs up on the first
+    mismatch, so neither a wrong nor a right answer is ever buffered whole.
+
+    Attributes:
+    - `query` (str): The query to be sent to the Bittensor network. Immutable.
+
+    - `sampling_params` (ChallengeSamplingParams): The sampling parameters, including the seed. Immutable.
+
+    - `required_hash_fields` (Optional[List[str]]): A list of fields that are required for the hash.
+    """
+
+
+class Challenge(bt.Synapse):
     """
     Challenge is a specialized implementation of the `StreamingSynapse` tailored for prompting functionalities within
     the Bittensor network. This class is intended to interact with a streaming response that contains a sequence of tokens,
@@ -54,7 +181,6 @@ class Inference(bt.Synapse):
     decoding, and accumulation of tokens that represent these prompts.
 
     Attributes:
-
     - `query` (str): The query to be sent to the Bittensor network. Immutable.
 
     - `seed` (int): The seed used to generate the output. Immutable.
@@ -62,6 +188,7 @@ class Inference(bt.Synapse):
     - `completion` (str): Stores the processed result of the streaming tokens. As tokens are streamed, decoded, and
                           processed, they are accumulated in the completion attribute. This represents the "final"
                           product or result of the streaming process.
+
     - `required_hash_fields` (Optional[List[str]]): A list of fields that are required for the hash.
 
 
@@ -79,12 +206,19 @@ class Inference(bt.Synapse):
         title="Sampling Params",
         description="The sampling parameters for the TGI model.",
     )
+
     completion: str = pydantic.Field(
         None,
         title="Completion",
         description="The processed result of the streaming tokens.",
     )
 
+    busy: bool = pydantic.Field(
+        False,
+        title="Busy",
+        description="Set by a prover that cannot serve the request before its timeout and answers straight away instead.",
+    )
+
     required_hash_fields: Optional[List[str]] = pydantic.Field(
         default_factory=lambda: ["query", "sampling_params"],
         title="Required Hash Fields",
@@ -92,31 +226,29 @@ class Inference(bt.Synapse):
         allow_mutation=False,
     )
 
+  
 
-class Challenge(bt.Synapse):
+
+class ChallengeDigest(bt.Synapse):
     """
-    Challenge is a specialized implementation of the `StreamingSynapse` tailored for prompting functionalities within
-    the Bittensor network. This class is intended to interact with a streaming response that contains a sequence of tokens,
-    which represent prompts or messages in a certain scenario.
+    ChallengeDigest is the commit half of a commit-then-reveal challenge. The prover renders the challenge
+    exactly like a `Challenge` but answers with the sha256 digest of the completion only, a few hundred bytes
+    instead of the base64 video.
 
-    As a developer, when using or extending the `Challenge` class, you should be primarily focused on the structure
-    and behavior of the prompts you are working with. The class has been designed to seamlessly handle the streaming,
-    decoding, and accumulation of tokens that represent these prompts.
+    The verifier compares the digest with its ground truth hash and, for a random share of the rounds where
+    they agree, follows up with a `StreamingChallenge` for the same query and seed to check the payload hashes
+    to the digest. The prover keeps recent completions cached, so the reveal does not render again.
 
     Attributes:
     - `query` (str): The query to be sent to the Bittensor network. Immutable.
 
-    - `seed` (int): The seed used to generate the output. Immutable.
-
-    - `completion` (str): Stores the processed result of the streaming tokens. As tokens are streamed, decoded, and
-                          processed, they are accumulated in the completion attribute. This represents the "final"
-                          product or result of the streaming process.
+    - `sampling_params` (ChallengeSamplingParams): The sampling parameters, including the seed. Immutable.
 
-    - `required_hash_fields` (Optional[List[str]]): A list of fields that are required for the hash.
+    - `digest` (str): The sha256 hex digest of the completion, as computed by `hashing_function`.
 
+    - `busy` (bool): Set by a prover that cannot serve the request before its timeout.
 
-    Note: While you can directly use the `Challenge` class, it's designed to be extensible. Thus, you can create
-    subclasses to further customize behavior for specific prompting scenarios or requirements.
+    - `required_hash_fields` (Optional[List[str]]): A list of fields that are required for the hash.
     """
     query: str = pydantic.Field(
         ...,
@@ -130,10 +262,16 @@ class Challenge(bt.Synapse):
         description="The sampling parameters for the TGI model.",
     )
 
-    completion: str = pydantic.Field(
+    digest: Optional[str] = pydantic.Field(
         None,
-        title="Completion",
-        description="The processed result of the streaming tokens.",
+        title="Digest",
+        description="The sha256 hex digest of the completion.",
+    )
+
+    busy: bool = pydantic.Field(
+        False,
+        title="Busy",
+        description="Set by a prover that cannot serve the request before its timeout and answers straight away instead.",
     )
 
     required_hash_fields: Optional[List[str]] = pydantic.Field(
@@ -143,4 +281,49 @@ class Challenge(bt.Synapse):
         allow_mutation=False,
     )
 
-  
+
+class Capabilities(bt.Synapse):
+    """
+    Capabilities asks a prover what load it can take. Verifiers query it now and then, cache the answer per
+    uid and use it to size their timeouts.
+
+    Attributes:
+    - `max_concurrency` (int): Requests the prover renders at the same time.
+
+    - `profiles` (List[str]): The rendering profiles its model servers support.
+
+    - `queue_depth` (int): Requests currently waiting for a model slot.
+
+    - `latency_p50` (float): Median seconds the prover's recent renders took, queue wait included.
+
+    - `latency_p95` (float): 95th percentile of the same.
+    """
+    max_concurrency: Optional[int] = pydantic.Field(
+        None,
+        title="Max Concurrency",
+        description="Requests the prover renders at the same time.",
+    )
+
+    profiles: Optional[List[str]] = pydantic.Field(
+        None,
+        title="Profiles",
+        description="The rendering profiles the prover's model servers support.",
+    )
+
+    queue_depth: Optional[int] = pydantic.Field(
+        None,
+        title="Queue Depth",
+        description="Requests currently waiting for a model slot.",
+    )
+
+    latency_p50: Optional[float] = pydantic.Field(
+        None,
+        title="Latency p50",
+        description="Median seconds the prover's recent renders took, queue wait included.",
+    )
+
+    latency_p95: Optional[float] = pydantic.Field(
+        None,
+        title="Latency p95",
+        description="95th percentile seconds the prover's recent renders took, queue wait included.",
+    )
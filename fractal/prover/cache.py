@@ -0,0 +1,157 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import time
+import asyncio
+import collections
+
+from fractal.prover.scheduler import SchedulerError
+
+
+class Waiters:
+    """
+    The callers waiting on one completion. Its generation is scheduled with the highest stake and the latest
+    deadline among them; `changed` is set when a caller joins with either.
+    """
+
+    def __init__(self, stake: float, budget: float = None):
+        self.future = asyncio.get_running_loop().create_future()
+        self.stake = stake
+        self.deadline = time.monotonic() + budget if budget is not None else None
+        self.changed = asyncio.Event()
+
+    def join(self, stake: float, budget: float = None):
+        if stake > self.stake:
+            self.stake = stake
+            self.changed.set()
+        if self.deadline is not None:
+            deadline = time.monotonic() + budget if budget is not None else None
+            if deadline is None or deadline > self.deadline:
+                self.deadline = deadline
+                self.changed.set()
+
+    def budget(self):
+        """Seconds until the latest deadline among the callers, None if one of them has none."""
+        return self.deadline - time.monotonic() if self.deadline is not None else None
+
+
+class CompletionCache:
+    """
+    Recently generated completions keyed by (query, seed), bounded by the total size of the completions and
+    expired after `ttl` seconds. Generation is deterministic per key, so a hit is as good as a fresh render.
+
+    `get_or_generate` also coalesces concurrent requests for the same key: the first one generates, on behalf
+    of all of them, and the others wait for its result instead of queueing a duplicate render.
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.inflight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, completion = entry
+        if expires_at < time.monotonic():
+            self.discard(key)
+            return None
+        self.entries.move_to_end(key)
+        return completion
+
+    def put(self, key, completion: str):
+        size = len(completion)
+        if size > self.max_bytes:
+            return
+        self.discard(key)
+        self.entries[key] = (time.monotonic() + self.ttl, completion)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self.discard(oldest)
+            self.evictions += 1
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[1])
+
+    async def get_or_generate(self, key, generate, stake: float = 0.0, budget: float = None):
+        """
+        Returns the cached completion for `key`, or awaits `generate(waiters)` once for all concurrent callers
+        and caches its result. `waiters` is the `Waiters` of the key, whose stake and budget the generation
+        is to be scheduled with.
+
+        Failures are shared with the waiting callers but not cached. Outcomes that only concern the caller
+        that generated, its cancellation or a `SchedulerError`, are not shared: the other callers try again.
+        """
+        while True:
+            completion = self.get(key)
+            if completion is not None:
+                self.hits += 1
+                return completion
+
+            waiters = self.inflight.get(key)
+            if waiters is None:
+                break
+            self.coalesced += 1
+            waiters.join(stake, budget)
+            await asyncio.wait([waiters.future])
+            if waiters.future.cancelled() or isinstance(waiters.future.exception(), SchedulerError):
+                continue
+            return waiters.future.result()
+
+        self.misses += 1
+        waiters = Waiters(stake, budget)
+        self.inflight[key] = waiters
+        try:
+            completion = await generate(waiters)
+        except asyncio.CancelledError:
+            waiters.future.cancel()
+            raise
+        except Exception as e:
+            waiters.future.set_exception(e)
+            # Retrieve it so a failure nobody else waited for is not reported as unhandled.
+            waiters.future.exception()
+            raise
+        finally:
+            # Failed or not, the next caller for the key generates again.
+            del self.inflight[key]
+
+        waiters.future.set_result(completion)
+        self.put(key, completion)
+        return completion
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+        }
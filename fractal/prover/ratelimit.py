@@ -0,0 +1,95 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import time
+import threading
+import collections
+
+
+class StakeRateLimiter:
+    """
+    One token bucket per caller hotkey. A caller's refill rate is its share of `rate`, the requests per second
+    the prover accepts overall, proportional to its share of the metagraph's stake and never below
+    `min_rate`. A bucket holds `burst` seconds worth of tokens (at least one).
+
+    Buckets are refilled lazily when checked, so idle callers cost nothing. A `rate` of 0 disables limiting.
+    The axon checks buckets from its own thread while the prover loop prunes and reports them, hence the lock.
+    """
+
+    def __init__(self, rate: float, min_rate: float, burst: float):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.burst = burst
+        # hotkey -> [tokens, last refill]
+        self.buckets = {}
+        self.allowed = collections.Counter()
+        self.throttled = collections.Counter()
+        self.lock = threading.Lock()
+
+    def scale(self, fraction: float):
+        """
+        Keeps `fraction` of the rates, for a limiter enforcing its part of the limits next to others that
+        each see a share of the requests.
+        """
+        self.rate *= fraction
+        self.min_rate *= fraction
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def allow(self, hotkey: str, stake_share: float) -> bool:
+        """Takes a token from `hotkey`'s bucket; returns False if it is empty."""
+        if not self.enabled:
+            return True
+
+        rate = max(self.min_rate, self.rate * stake_share)
+        capacity = max(1.0, rate * self.burst)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(hotkey)
+            if bucket is None:
+                bucket = self.buckets[hotkey] = [capacity, now]
+            else:
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] < 1:
+                self.throttled[hotkey] += 1
+                return False
+            bucket[0] -= 1
+            self.allowed[hotkey] += 1
+            return True
+
+    def prune(self, hotkeys):
+        """Forgets the buckets and counters of callers not in `hotkeys`, e.g. deregistered verifiers."""
+        with self.lock:
+            for hotkey in list(self.buckets):
+                if hotkey not in hotkeys:
+                    del self.buckets[hotkey]
+                    self.allowed.pop(hotkey, None)
+                    self.throttled.pop(hotkey, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "callers": len(self.buckets),
+                "allowed": sum(self.allowed.values()),
+                "throttled": sum(self.throttled.values()),
+                # Callers that hit their limit, most throttled first.
+                "throttled_by_hotkey": dict(self.throttled.most_common(10)),
+            }
@@ -0,0 +1,232 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import math
+import time
+import heapq
+import asyncio
+import contextlib
+
+
+class SchedulerError(Exception):
+    """Base class for requests the scheduler did not admit to the model."""
+
+
+class QueueFullError(SchedulerError):
+    """The wait queue was full of requests with a higher priority, or a higher priority request took the place."""
+
+
+class QueueTimeoutError(SchedulerError):
+    """The request's budget ran out before a slot became free."""
+
+
+class ProverBusyError(SchedulerError):
+    """The request would not finish within its budget given the queue ahead of it and recent service times."""
+
+
+class StakeScheduler:
+    """
+    Bounds the number of requests running against the model and orders the ones waiting by the caller's stake.
+
+    A waiting request's priority is `log1p(stake) + aging * seconds_waited`: stake decides who goes first, the
+    logarithm keeps one whale from owning the queue and aging lets low stake callers through eventually.
+    Every waiting request ages at the same rate, so the heap can be keyed once on
+    `log1p(stake) - aging * enqueued_at` and never needs to be reordered.
+
+    When the queue is full a new request takes the place of the lowest priority waiter if it outranks it,
+    otherwise it is rejected straight away.
+
+    The time requests hold their slot is tracked as a moving average, from which `estimate` predicts how long
+    a new request would take to finish, queue wait included.
+
+    Must be used from a single event loop.
+    """
+
+    # Weight of the newest service time in the moving average.
+    SERVICE_TIME_ALPHA = 0.2
+
+    def __init__(self, max_concurrency: int, max_queue: int, aging: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.aging = aging
+        self.queue = []
+        self.sequence = 0
+        self.in_flight = 0
+        self.service_time = None
+
+        self.admitted = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.expired = 0
+        self.max_wait = 0.0
+        self.total_wait = 0.0
+        self.shed = 0
+
+    def priority(self, stake: float, enqueued_at: float) -> float:
+        return math.log1p(max(stake, 0.0)) - self.aging * enqueued_at
+
+    def admit(self, enqueued_at: float):
+        self.in_flight += 1
+        self.admitted += 1
+        wait = time.monotonic() - enqueued_at
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def dispatch(self):
+        while self.queue and self.in_flight < self.max_concurrency:
+            _, _, enqueued_at, future = heapq.heappop(self.queue)
+            if future.done():
+                continue
+            self.admit(enqueued_at)
+            future.set_result(None)
+
+    def remove(self, entry):
+        self.queue.remove(entry)
+        heapq.heapify(self.queue)
+
+    async def acquire(self, stake: float, timeout: float = None):
+        """
+        Waits until the request may run against the model.
+
+        Raises:
+            QueueFullError: If the request was rejected or displaced by higher priority requests.
+            QueueTimeoutError: If no slot became free within `timeout` seconds.
+        """
+        now = time.monotonic()
+        if self.in_flight < self.max_concurrency and not self.queue:
+            self.admit(now)
+            return
+
+        priority = self.priority(stake, now)
+        if len(self.queue) >= self.max_queue:
+            # Without a queue to wait in (max_queue=0) there is nobody to displace.
+            lowest = max(self.queue) if self.queue else None
+            if lowest is None or -lowest[0] >= priority:
+                self.rejected += 1
+                raise QueueFullError(f"wait queue is full ({len(self.queue)} requests)")
+            self.remove(lowest)
+            self.evicted += 1
+            lowest[3].set_exception(QueueFullError("displaced by a higher priority request"))
+
+        # Negated, heapq pops the smallest key first.
+        self.sequence += 1
+        entry = [-priority, self.sequence, now, asyncio.get_running_loop().create_future()]
+        heapq.heappush(self.queue, entry)
+
+        future = entry[3]
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Admitted just as the budget ran out; hand the slot on.
+                self.release()
+            else:
+                future.cancel()
+                self.remove(entry)
+                self.expired += 1
+            raise QueueTimeoutError(f"no slot within {timeout:.1f}s")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            elif entry in self.queue:
+                future.cancel()
+                self.remove(entry)
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self.dispatch()
+
+    def estimate(self, stake: float):
+        """
+        Predicts the seconds until a request from a caller with `stake` would finish: the rounds of slots
+        taken by the requests running and queued ahead of it, plus its own service time. None until a
+        request has completed.
+        """
+        if self.service_time is None:
+            return None
+        priority = self.priority(stake, time.monotonic())
+        ahead = sum(1 for entry in self.queue if -entry[0] >= priority)
+        rounds = (self.in_flight + ahead) // max(self.max_concurrency, 1)
+        return (rounds + 1) * self.service_time
+
+    def check(self, stake: float, budget: float):
+        """
+        Raises:
+            ProverBusyError: If the request is not expected to finish within `budget` seconds.
+        """
+        estimate = self.estimate(stake)
+        if estimate is not None and estimate > budget:
+            self.shed += 1
+            raise ProverBusyError(f"expected to finish in {estimate:.1f}s, {budget:.1f}s left")
+
+    async def acquire_for(self, waiters):
+        """
+        Waits until coalesced requests (see `CompletionCache`) may run against the model, with the highest
+        stake and until the latest deadline among them. When a request joins with more stake or a longer
+        budget, the wait is queued again with them.
+
+        Raises:
+            QueueFullError: If the requests were rejected or displaced by higher priority requests.
+            QueueTimeoutError: If no slot became free before the latest deadline.
+        """
+        while True:
+            waiters.changed.clear()
+            acquire = asyncio.ensure_future(self.acquire(waiters.stake, waiters.budget()))
+            changed = asyncio.ensure_future(waiters.changed.wait())
+            try:
+                await asyncio.wait([acquire, changed], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                changed.cancel()
+                if not acquire.done():
+                    acquire.cancel()
+            # A cancelled wait gives up its place, or the slot it was admitted to just now.
+            await asyncio.wait([acquire])
+            if not acquire.cancelled():
+                return acquire.result()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, stake: float = 0.0, timeout: float = None, waiters=None):
+        """Holds a slot for the duration of the `async with` block, for one request or for `waiters`."""
+        if waiters is not None:
+            await self.acquire_for(waiters)
+        else:
+            await self.acquire(stake, timeout)
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start_time
+            if self.service_time is None:
+                self.service_time = elapsed
+            else:
+                self.service_time = self.SERVICE_TIME_ALPHA * elapsed + (1 - self.SERVICE_TIME_ALPHA) * self.service_time
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self.queue),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "shed": self.shed,
+            "service_time": self.service_time,
+            "mean_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait": self.max_wait,
+        }
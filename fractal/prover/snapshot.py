@@ -0,0 +1,117 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import json
+import struct
+from typing import Dict, List, Optional
+from multiprocessing.shared_memory import SharedMemory
+
+
+# Sequence number and payload length in front of the published snapshot.
+SEQLOCK_HEADER = struct.Struct("<QQ")
+DEFAULT_SNAPSHOT_SIZE = 4 * 1024 * 1024  # Room for a few thousand uids.
+
+
+class MetagraphSnapshot:
+    """
+    Lookup tables over a metagraph for the axon's per request hooks: a hotkey to uid dict and plain lists of
+    stakes and validator permits, so blacklist and priority never scan `metagraph.hotkeys` or index tensors.
+
+    A snapshot is never modified. `resync_metagraph` builds a new one and swaps it in with a single
+    assignment, so a request always sees one consistent metagraph.
+    """
+
+    def __init__(self, hotkeys: List[str], stakes: List[float], permits: List[bool]):
+        self.hotkeys = hotkeys
+        self.uids: Dict[str, int] = {hotkey: uid for uid, hotkey in enumerate(hotkeys)}
+        self.stakes = stakes
+        self.permits = permits
+        self.total_stake = sum(stakes)
+
+    @classmethod
+    def from_metagraph(cls, metagraph) -> "MetagraphSnapshot":
+        return cls(
+            hotkeys=list(metagraph.hotkeys),
+            stakes=[float(stake) for stake in metagraph.S.tolist()],
+            permits=[bool(permit) for permit in metagraph.validator_permit.tolist()],
+        )
+
+    def uid(self, hotkey: str) -> Optional[int]:
+        return self.uids.get(hotkey)
+
+    def is_registered(self, hotkey: str) -> bool:
+        return hotkey in self.uids
+
+    def stake(self, hotkey: str) -> float:
+        """Stake of `hotkey`, 0 for hotkeys not in the metagraph."""
+        uid = self.uids.get(hotkey)
+        return self.stakes[uid] if uid is not None else 0.0
+
+    def has_permit(self, hotkey: str) -> bool:
+        uid = self.uids.get(hotkey)
+        return uid is not None and self.permits[uid]
+
+
+class SharedSnapshot:
+    """
+    A metagraph snapshot published by one writer process to reader processes through shared memory.
+
+    The segment is guarded by a seqlock: the writer makes the sequence number odd, writes, and makes it even
+    again. A reader copies the payload between two reads of the sequence number and retries if they differ
+    or are odd, so it never sees a torn snapshot and never blocks the writer. Readers only decode a new
+    snapshot when the sequence number moved.
+
+    Create it before forking; the children share the mapping.
+    """
+
+    def __init__(self, size: int = DEFAULT_SNAPSHOT_SIZE):
+        self.shm = SharedMemory(create=True, size=SEQLOCK_HEADER.size + size)
+        SEQLOCK_HEADER.pack_into(self.shm.buf, 0, 0, 0)
+        self.size = size
+
+    def publish(self, snapshot: MetagraphSnapshot):
+        payload = json.dumps(
+            {"hotkeys": snapshot.hotkeys, "stakes": snapshot.stakes, "permits": snapshot.permits}
+        ).encode()
+        if len(payload) > self.size:
+            raise ValueError(f"Snapshot of {len(payload)} bytes exceeds shared segment of {self.size}")
+
+        sequence, _ = SEQLOCK_HEADER.unpack_from(self.shm.buf, 0)
+        SEQLOCK_HEADER.pack_into(self.shm.buf, 0, sequence + 1, 0)
+        start = SEQLOCK_HEADER.size
+        self.shm.buf[start:start + len(payload)] = payload
+        SEQLOCK_HEADER.pack_into(self.shm.buf, 0, sequence + 2, len(payload))
+
+    def read(self, last_sequence: int = 0):
+        """
+        Returns `(sequence, snapshot)` for a snapshot published after `last_sequence`, or None if there is
+        none yet.
+        """
+        while True:
+            sequence, length = SEQLOCK_HEADER.unpack_from(self.shm.buf, 0)
+            if sequence == last_sequence or sequence == 0:
+                return None
+            if sequence % 2:
+                continue
+            start = SEQLOCK_HEADER.size
+            payload = bytes(self.shm.buf[start:start + length])
+            if SEQLOCK_HEADER.unpack_from(self.shm.buf, 0)[0] == sequence:
+                return sequence, MetagraphSnapshot(**json.loads(payload))
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,148 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import bittensor as bt
+
+
+# Upper bounds in seconds of the histogram buckets, from a cache hit to a request left waiting a full timeout.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120)
+
+# Per request scratch space shared between the timing middleware and the forward handler running in a
+# task it spawned; the middleware sets a fresh dict and the handler fills it in.
+REQUEST_TIMINGS = contextvars.ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """Counts of observations per fixed bucket, plus their sum, rendered cumulatively like Prometheus."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Telemetry:
+    """
+    Latency histograms of the prover's requests by stage, synapse type and caller hotkey, plus gauges read
+    from the prover's components, served as Prometheus text on a local port.
+
+    Stages:
+        receive: from the dendrite sending the request to the forward handler starting (when the caller's
+            clock can be trusted, see `BaseProverNeuron.time_since_sent`).
+        queue: waiting for a model slot.
+        model: the model endpoint call.
+        forward: the whole forward handler, cache hits included.
+        serialize: axon time outside the forward handler: verification, body parsing and serialising the
+            response.
+    """
+
+    METRIC = "fractal_prover_request_seconds"
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def observe(self, stage: str, synapse: str, hotkey: str, seconds: float):
+        key = (stage, synapse, hotkey)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, synapse: str, hotkey: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, synapse, hotkey, time.perf_counter() - start)
+
+    def register_gauges(self, prefix: str, stats):
+        """Exports the numeric values of the dict returned by `stats()` as `fractal_prover_<prefix>_<key>`."""
+        self.gauges[prefix] = stats
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.METRIC} Prover request latency by stage, synapse and caller hotkey.",
+            f"# TYPE {self.METRIC} histogram",
+        ]
+        with self.lock:
+            for (stage, synapse, hotkey), histogram in sorted(self.histograms.items()):
+                labels = f'stage="{stage}",synapse="{synapse}",hotkey="{hotkey}"'
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{self.METRIC}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{self.METRIC}_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"{self.METRIC}_count{{{labels}}} {histogram.count}")
+
+        for prefix, stats in self.gauges.items():
+            try:
+                values = stats()
+            except Exception as e:
+                bt.logging.debug(f"Failed to read {prefix} metrics: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f"fractal_prover_{prefix}_{key}"
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """Serves `render()` on http://host:port/metrics from a daemon thread."""
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = telemetry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        bt.logging.info(f"Serving prover metrics on http://{host}:{port}/metrics")
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,248 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import os
+import time
+import select
+import signal
+import socket
+import asyncio
+import threading
+import uvicorn
+import bittensor as bt
+
+from fractal.prover.snapshot import SharedSnapshot
+from fractal.utils.handoff import inherited_pids
+
+
+# Seconds between a worker's checks for a newer metagraph snapshot.
+SNAPSHOT_POLL_INTERVAL = 1.0
+# Seconds a worker gets to finish its requests after SIGTERM before it is killed.
+STOP_TIMEOUT = 10
+# Seconds to wait for a new worker to accept connections.
+READY_TIMEOUT = 30
+# Seconds between a worker's attempts to bind its metrics port while a draining worker still holds it.
+METRICS_RETRY_INTERVAL = 1.0
+
+
+def reuseport_socket(host: str, port: int) -> socket.socket:
+    """
+    A listening socket that other processes can bind to the same port; the kernel spreads incoming
+    connections over all of them.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class AxonWorkers:
+    """
+    Serves the prover's axon from `num_workers` forked processes, each running its own uvicorn server on a
+    SO_REUSEPORT socket, so parsing, signature checks and serialising multi-MB bodies use more than one core.
+
+    The parent keeps syncing with the chain and publishes every new metagraph snapshot through shared
+    memory; the workers pick it up for their blacklist and priority hooks. Everything else a worker holds
+    (model client, scheduler, cache, rate limits, seen nonces) is its own copy; see
+    `BaseProverNeuron.prepare_worker`.
+
+    Workers are forked, which only carries over the calling thread, so `start` and `check` must run on the
+    main thread before (or without) other threads holding locks the workers need.
+
+    After a handoff restart the previous image's workers are still serving; they are sent SIGTERM, and
+    drain, once every new worker accepts connections.
+    """
+
+    def __init__(self, neuron, num_workers: int):
+        self.neuron = neuron
+        self.num_workers = num_workers
+        self.shared = SharedSnapshot()
+        self.pids = {}
+        # Workers of the previous image, still serving until ours all came up.
+        self.previous = []
+        self.draining = []
+        # Indices of the workers that died starting up, until a restart of theirs comes up.
+        self.failed = set()
+
+    def start(self):
+        self.publish(self.neuron.snapshot)
+        for index in range(self.num_workers):
+            self.spawn(index)
+
+        self.previous = inherited_pids()
+        self.drain_previous()
+
+    def drain_previous(self):
+        """Sends SIGTERM to the previous image's workers once all of ours are serving."""
+        if not self.previous:
+            return
+        if self.failed:
+            bt.logging.warning(
+                f"Axon workers {sorted(self.failed)} did not come up, the previous prover's workers keep serving."
+            )
+            return
+        for pid in self.previous:
+            bt.logging.info(f"Draining axon worker pid {pid} of the previous prover.")
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        self.draining, self.previous = self.draining + self.previous, []
+
+    def spawn(self, index: int):
+        """
+        Forks worker `index` and waits until it accepts connections. A worker that exits before it does is
+        recorded in `failed`, for `check` to restart.
+        """
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            os.close(ready_read)
+            try:
+                self.run_worker(index, ready_write)
+            except BaseException:
+                bt.logging.error(f"Axon worker {index} failed", exc_info=True)
+                code = 1
+            finally:
+                # Never return into the parent's code.
+                os._exit(code)
+        os.close(ready_write)
+        try:
+            if not select.select([ready_read], [], [], READY_TIMEOUT)[0]:
+                # Still starting up rather than dead; counted as up.
+                bt.logging.warning(f"Axon worker {index} is not ready after {READY_TIMEOUT}s.")
+                ready = True
+            else:
+                # End of file instead of the ready byte: the worker exited.
+                ready = os.read(ready_read, 1) == b"1"
+        finally:
+            os.close(ready_read)
+        self.pids[pid] = index
+        if ready:
+            self.failed.discard(index)
+            bt.logging.info(f"Started axon worker {index} with pid {pid}")
+        else:
+            self.failed.add(index)
+            bt.logging.warning(f"Axon worker {index} (pid {pid}) exited while starting up.")
+
+    def run_worker(self, index: int, ready_fd: int):
+        self.neuron.prepare_worker(index, self.num_workers)
+        # Signals are handled by uvicorn in the worker.
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        sock = reuseport_socket("0.0.0.0", self.neuron.config.axon.port)
+        if self.neuron.config.neuron.metrics_port:
+            self.serve_metrics(self.neuron.config.neuron.metrics_port + 1 + index)
+        log_level = "trace" if bt.logging.__trace_on__ else "critical"
+        server = uvicorn.Server(uvicorn.Config(self.neuron.axon.app, log_level=log_level, loop="asyncio"))
+
+        async def signal_ready():
+            while not server.started:
+                await asyncio.sleep(0.01)
+            os.write(ready_fd, b"1")
+            os.close(ready_fd)
+
+        async def serve():
+            follower = asyncio.ensure_future(self.follow_snapshot())
+            ready = asyncio.ensure_future(signal_ready())
+            try:
+                await server.serve(sockets=[sock])
+            finally:
+                follower.cancel()
+                ready.cancel()
+
+        asyncio.run(serve())
+
+    def serve_metrics(self, port: int):
+        """
+        Serves the worker's metrics on `port`. After a handoff the draining worker of the same index holds the
+        port until it exits, so binding is retried in the background rather than failing the worker.
+        """
+        def bind():
+            logged = False
+            while True:
+                try:
+                    self.neuron.telemetry.serve(port)
+                    return
+                except OSError as e:
+                    if not logged:
+                        bt.logging.info(f"Metrics port {port} is taken ({e}), retrying until it is free.")
+                        logged = True
+                time.sleep(METRICS_RETRY_INTERVAL)
+
+        threading.Thread(target=bind, daemon=True).start()
+
+    async def follow_snapshot(self):
+        sequence = 0
+        while True:
+            published = self.shared.read(sequence)
+            if published is not None:
+                sequence, snapshot = published
+                self.neuron.update_snapshot(snapshot)
+            await asyncio.sleep(SNAPSHOT_POLL_INTERVAL)
+
+    def publish(self, snapshot):
+        self.shared.publish(snapshot)
+
+    def check(self):
+        """Restarts workers that died and reaps drained workers of the previous image."""
+        for pid in list(self.draining):
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    self.draining.remove(pid)
+            except ChildProcessError:
+                self.draining.remove(pid)
+
+        for pid, index in list(self.pids.items()):
+            exited, status = os.waitpid(pid, os.WNOHANG)
+            if exited:
+                del self.pids[pid]
+                bt.logging.warning(f"Axon worker {index} (pid {pid}) exited with status {status}, restarting it.")
+                self.spawn(index)
+        self.drain_previous()
+
+    def stop(self):
+        for pid in self.previous:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        self.previous = []
+
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + STOP_TIMEOUT
+        while self.pids and time.monotonic() < deadline:
+            for pid in list(self.pids):
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    del self.pids[pid]
+            time.sleep(0.1)
+        for pid in self.pids:
+            bt.logging.warning(f"Axon worker pid {pid} did not stop, killing it.")
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.pids = {}
+        self.shared.close()
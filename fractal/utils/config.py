@@ -121,6 +121,68 @@ def add_args(cls, parser):
     )
 
 
+def add_model_client_args(cls, parser, default_endpoint: str):
+    """Add the arguments of the model server client shared by provers and verifiers."""
+
+    parser.add_argument(
+        "--neuron.model_endpoint",
+        type=str,
+        nargs="+",
+        help="The endpoint(s) to use for the model client. Requests are balanced across several endpoints.",
+        default=default_endpoint,
+    )
+
+    parser.add_argument(
+        "--neuron.model_pool_size",
+        type=int,
+        help="The maximum number of pooled connections to the model endpoint.",
+        default=8,
+    )
+
+    parser.add_argument(
+        "--neuron.model_timeout",
+        type=float,
+        help="The default timeout in seconds for a request to the model endpoint.",
+        default=120,
+    )
+
+    parser.add_argument(
+        "--neuron.model_balancing",
+        type=str,
+        choices=["least_outstanding", "ewma"],
+        help="How to pick a model endpoint: fewest requests in flight or lowest latency moving average.",
+        default="least_outstanding",
+    )
+
+    parser.add_argument(
+        "--neuron.model_hedge_percentile",
+        type=float,
+        help="Duplicate a model request on a second endpoint once it runs longer than this latency percentile. 0 disables hedging.",
+        default=0,
+    )
+
+    parser.add_argument(
+        "--neuron.model_failure_threshold",
+        type=int,
+        help="Consecutive failures after which a model endpoint's circuit opens and requests to it fail fast.",
+        default=5,
+    )
+
+    parser.add_argument(
+        "--neuron.model_reset_timeout",
+        type=float,
+        help="Seconds an open circuit waits before letting a trial request through to the model endpoint.",
+        default=30,
+    )
+
+    parser.add_argument(
+        "--neuron.model_health_interval",
+        type=float,
+        help="Seconds between active /health probes of every model endpoint. 0 disables probing.",
+        default=10,
+    )
+
+
 def add_prover_args(cls, parser):
     """Add prover specific arguments to the parser."""
 
@@ -153,12 +215,90 @@ def add_prover_args(cls, parser):
     )
 
     parser.add_argument(
-        "--neuron.model_endpoint",
-        type=str,
-        help="The endpoint to use for the model client.",
-        default="http://127.0.0.1:8080",
+        "--blacklist.rate_limit",
+        type=float,
+        help="Requests per second accepted from all callers together, shared out by stake. Callers over their "
+        "share are blacklisted until their bucket refills. 0 disables rate limiting.",
+        default=0,
+    )
+
+    parser.add_argument(
+        "--blacklist.rate_limit_min",
+        type=float,
+        help="Requests per second every caller may send regardless of its stake.",
+        default=0.05,
     )
 
+    parser.add_argument(
+        "--blacklist.rate_limit_burst",
+        type=float,
+        help="Seconds worth of requests a caller may send at once before being limited to its rate.",
+        default=30,
+    )
+
+    parser.add_argument(
+        "--neuron.deadline_margin",
+        type=float,
+        help="Seconds of the verifier's timeout kept back for returning the response. The rest is the "
+        "deadline forwarded to the model server.",
+        default=2.0,
+    )
+
+    parser.add_argument(
+        "--neuron.axon_workers",
+        type=int,
+        help="Processes serving the axon, bound to the same port with SO_REUSEPORT. Each keeps its own model "
+        "client, queue, cache and nonces, and enforces its share of the rate limits.",
+        default=1,
+    )
+
+    parser.add_argument(
+        "--neuron.metrics_port",
+        type=int,
+        help="Local port serving request latency histograms in the Prometheus text format on 127.0.0.1. "
+        "Axon worker i serves on metrics_port + 1 + i. 0 disables the endpoint.",
+        default=0,
+    )
+
+    parser.add_argument(
+        "--neuron.max_concurrency",
+        type=int,
+        help="Requests forwarded to the model endpoints at once. Match it to the model capacity; further "
+        "requests wait in a stake ordered queue.",
+        default=2,
+    )
+
+    parser.add_argument(
+        "--neuron.max_queue",
+        type=int,
+        help="Requests allowed to wait for the model. Beyond this the lowest stake requests are rejected.",
+        default=32,
+    )
+
+    parser.add_argument(
+        "--neuron.queue_aging",
+        type=float,
+        help="Priority a waiting request gains per second, on top of log(1 + stake), so low stake callers are not starved.",
+        default=0.2,
+    )
+
+    parser.add_argument(
+        "--neuron.cache_size_mb",
+        type=float,
+        help="Memory in MB for recently generated completions, answered again without the model. 0 disables the cache.",
+        default=256,
+    )
+
+    parser.add_argument(
+        "--neuron.cache_ttl",
+        type=float,
+        help="Seconds a cached completion is served for.",
+        default=600,
+    )
+
+    add_model_client_args(cls, parser, default_endpoint="http://127.0.0.1:8080")
+
+
 def add_verifier_args(cls, parser):
     """Add verifier specific arguments to the parser."""
 
@@ -265,12 +405,30 @@ def add_verifier_args(cls, parser):
         )
     
     parser.add_argument(
-        "--neuron.model_endpoint",
-        type=str,
-        help="The endpoint to use for the model client.",
-        default="http://localhost:8080",
+        "--neuron.reveal_probability",
+        type=float,
+        help="Share of challenges with a correct digest that also fetch the full video, to check it hashes to "
+        "the digest. 1 always fetches the video.",
+        default=0.1,
     )
-    
+
+    parser.add_argument(
+        "--neuron.capability_ttl",
+        type=float,
+        help="Seconds a prover's reported capabilities are trusted before they are queried again.",
+        default=300,
+    )
+
+    parser.add_argument(
+        "--neuron.ground_truth_queue",
+        type=int,
+        help="Number of challenges kept rendered ahead of time in the database. 0 renders every challenge's "
+        "ground truth inline.",
+        default=8,
+    )
+
+    add_model_client_args(cls, parser, default_endpoint="http://localhost:8080")
+
     parser.add_argument(
         "--database.host",
         type=str,
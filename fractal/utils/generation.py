@@ -0,0 +1,99 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import time
+import heapq
+import asyncio
+from loguru import logger
+
+# Requests without a budget are still ordered as if they had this many seconds left.
+DEFAULT_BUDGET = 600
+# Weight of the newest render time in the service time moving average.
+SERVICE_TIME_ALPHA = 0.2
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class GenerationQueue:
+    """
+    Earliest-deadline-first queue in front of the model server's pipeline. A single worker renders one request
+    at a time (seeding is global) with `render(seed, text, profile)` in a worker thread, so the event loop keeps
+    answering /health while the GPU is busy. Requests whose deadline passes while queued, or that cannot finish
+    before it given the recent render time, are dropped instead of rendered.
+    """
+
+    def __init__(self, render):
+        self.render = render
+        self.heap = []
+        self.sequence = 0
+        self.ready = asyncio.Event()
+        self.service_time = None
+        self.dropped = 0
+
+    def submit(self, seed, text, budget=None, profile="default"):
+        deadline = time.monotonic() + (budget if budget is not None else DEFAULT_BUDGET)
+        future = asyncio.get_running_loop().create_future()
+        self.sequence += 1
+        heapq.heappush(self.heap, (deadline, self.sequence, seed, text, profile, future))
+        self.ready.set()
+        return future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.heap:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+
+            deadline, _, seed, text, profile, future = heapq.heappop(self.heap)
+            if future.cancelled():
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (self.service_time is not None and remaining < self.service_time):
+                self.dropped += 1
+                logger.warning(f"Dropping request with {remaining:.1f}s left, renders take {self.service_time or 0:.1f}s")
+                future.set_exception(DeadlineExceeded(f"{remaining:.1f}s left"))
+                continue
+
+            start_time = time.monotonic()
+            try:
+                result = await loop.run_in_executor(None, self.render, seed, text, profile)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+                continue
+            elapsed = time.monotonic() - start_time
+            if self.service_time is None:
+                self.service_time = elapsed
+            else:
+                self.service_time = SERVICE_TIME_ALPHA * elapsed + (1 - SERVICE_TIME_ALPHA) * self.service_time
+            if not future.cancelled():
+                future.set_result(result)
+
+
+def error_status(e):
+    """Maps a failed generation to the HTTP status and message it is reported with."""
+    if isinstance(e, DeadlineExceeded):
+        return 408, f"Deadline exceeded: {e}"
+    if isinstance(e, RuntimeError) and "CUDA out of memory" in str(e):
+        logger.error("CUDA out of memory. Consider reducing the request rate or payload size.")
+        return 503, "CUDA out of memory. Try again later."
+    logger.opt(exception=e).error("An error occurred during request processing")
+    return 500, str(e)
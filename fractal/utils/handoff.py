@@ -0,0 +1,91 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import os
+import sys
+import socket
+import threading
+from typing import List, Optional
+
+from bittensor.axon import FastAPIThreadedServer
+
+
+# Environment variables a process sets for the image it execs into.
+LISTEN_FD_ENV = "FRACTAL_LISTEN_FD"
+DRAIN_PIDS_ENV = "FRACTAL_DRAIN_PIDS"
+
+# Seconds to wait for in-flight work before restarting anyway.
+DRAIN_TIMEOUT = 120
+
+
+def listening_socket(host: str, port: int, reuseport: bool = False) -> socket.socket:
+    """
+    Returns the listening socket handed over by the process this one was exec'd from, or binds a new one.
+    """
+    fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if fd is not None:
+        return socket.socket(fileno=int(fd))
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuseport:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+
+def inherited_pids() -> List[int]:
+    """Returns the pids of processes left serving by the previous image, to be drained once we serve."""
+    pids = os.environ.pop(DRAIN_PIDS_ENV, "")
+    return [int(pid) for pid in pids.split(",") if pid]
+
+
+def restart(listen_socket: Optional[socket.socket] = None, drain_pids: List[int] = ()):
+    """
+    Replaces the running process with a fresh start of the same command line, keeping the pid so process
+    managers such as pm2 see no exit. `listen_socket` survives the exec, so connections arriving during the
+    restart wait in its backlog instead of being refused. `drain_pids` are passed on to the new image.
+    """
+    env = dict(os.environ)
+    if listen_socket is not None:
+        listen_socket.set_inheritable(True)
+        env[LISTEN_FD_ENV] = str(listen_socket.fileno())
+    if drain_pids:
+        env[DRAIN_PIDS_ENV] = ",".join(str(pid) for pid in drain_pids)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execve(sys.executable, [sys.executable] + sys.argv, env)
+
+
+class SocketServer(FastAPIThreadedServer):
+    """
+    The axon's threaded uvicorn server, serving a socket we own instead of binding its own. uvicorn closes
+    the sockets it serves on shutdown, so it is given a duplicate and the socket outlives the server.
+    `stopped` is set once the server has shut down and every in-flight request has been answered.
+    """
+
+    def __init__(self, config, sock: socket.socket):
+        super().__init__(config=config)
+        self.sock = sock
+        self.stopped = threading.Event()
+
+    def run(self, sockets=None):
+        try:
+            super().run(sockets=[self.sock.dup()])
+        finally:
+            self.stopped.set()
@@ -0,0 +1,115 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import struct
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+
+# Every slot starts with the sequence number of the payload currently stored in it.
+SLOT_HEADER = struct.Struct("<Q")
+
+DEFAULT_NUM_SLOTS = 4
+DEFAULT_SLOT_SIZE = 8 * 1024 * 1024  # 8MB, comfortably above a 16 frame mp4.
+
+
+class SlotOverwrittenError(RuntimeError):
+    """Raised when a reader lost the race against the writer reusing its slot."""
+
+
+class SharedMemoryRing:
+    """
+    A fixed number of equally sized slots in a named shared memory segment.
+
+    The writer (the model server) hands slots out round robin and returns a small descriptor for every payload.
+    Readers attach to the segment by name and read the payload straight out of the mapping. Each slot is
+    prefixed with the sequence number of its payload so a reader can detect that the writer wrapped around
+    and reused the slot while it was still reading.
+    """
+
+    def __init__(
+        self,
+        name: str = None,
+        slot_size: int = DEFAULT_SLOT_SIZE,
+        num_slots: int = DEFAULT_NUM_SLOTS,
+        create: bool = False,
+    ):
+        self.slot_size = slot_size
+        self.num_slots = num_slots
+        self.created = create
+        if create:
+            self.shm = SharedMemory(
+                name=name, create=True, size=num_slots * (SLOT_HEADER.size + slot_size)
+            )
+        else:
+            self.shm = SharedMemory(name=name)
+            # Attaching registers the segment with this process' resource tracker, which would unlink it
+            # on exit and pull it from under the writer.
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.name = self.shm.name
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    @property
+    def max_payload(self) -> int:
+        return self.slot_size
+
+    def write(self, data: bytes) -> dict:
+        """
+        Copies `data` into the next slot and returns the descriptor a reader needs to fetch it.
+        """
+        if len(data) > self.slot_size:
+            raise ValueError(f"Payload of {len(data)} bytes exceeds slot size {self.slot_size}")
+
+        with self.lock:
+            self.sequence += 1
+            sequence = self.sequence
+            slot = (sequence - 1) % self.num_slots
+
+        offset = slot * (SLOT_HEADER.size + self.slot_size)
+        SLOT_HEADER.pack_into(self.shm.buf, offset, sequence)
+        start = offset + SLOT_HEADER.size
+        self.shm.buf[start:start + len(data)] = data
+
+        return {
+            "name": self.name,
+            "offset": offset,
+            "length": len(data),
+            "sequence": sequence,
+        }
+
+    def view(self, descriptor: dict) -> memoryview:
+        """
+        Returns a zero copy view on the payload described by `descriptor`. The view is only valid until
+        `check` fails; callers must consume it and then call `check`.
+        """
+        self.check(descriptor)
+        start = descriptor["offset"] + SLOT_HEADER.size
+        return self.shm.buf[start:start + descriptor["length"]]
+
+    def check(self, descriptor: dict):
+        (sequence,) = SLOT_HEADER.unpack_from(self.shm.buf, descriptor["offset"])
+        if sequence != descriptor["sequence"]:
+            raise SlotOverwrittenError(
+                f"Slot at offset {descriptor['offset']} holds sequence {sequence}, expected {descriptor['sequence']}"
+            )
+
+    def close(self):
+        self.shm.close()
+        if self.created:
+            self.shm.unlink()
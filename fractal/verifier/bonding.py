@@ -17,39 +17,44 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
-import asyncio
+import numpy as np
 import bittensor as bt
+from typing import List, Tuple
 
 from redis import asyncio as aioredis
 
 from fractal.constants import *
+from fractal.verifier.lua import REGISTER_PROVER, UPDATE_STATISTICS, scripting_available, run_pipelined
+from fractal.verifier.database import (
+    PROVERS_KEY,
+    GENERATION_KEY,
+    INTERVAL_PREFIX,
+    INTERVAL_TTL,
+    interval_key,
+    current_generation,
+    get_prover_hotkeys,
+)
 
+# The tiers from lowest to highest, and their thresholds as rows for `compute_new_tiers`.
+TIER_NAMES = list(TIER_CONFIG)
+TIER_INDEX = {name: index for index, name in enumerate(TIER_NAMES)}
+TIER_SUCCESS_RATES = np.array([[tier["success_rate"] for tier in TIER_CONFIG.values()]])
+TIER_REQUEST_LIMITS = np.array([[tier["request_limit"] for tier in TIER_CONFIG.values()]])
 
 
 
-async def reset_request_stats(stats_key: str, database: aioredis.Redis):
-    await database.hmset(
-        stats_key,
-        {
-            "inference_attempts": 0,
-            "inference_successes": 0,
-            "challenge_successes": 0,
-            "challenge_attempts": 0,
-            "total_interval_successes": 0,
-        },
-    )
-
 
 async def rollover_request_stats(database: aioredis.Redis):
     """
     Asynchronously resets the request statistics for all provers.
-    This function should be called periodically to reset the statistics for all provers.
+    This function should be called periodically to reset the statistics for all provers. It starts a new
+    generation of interval counters, a single write however many provers there are; the counters of the
+    previous interval expire on their own.
     Args:
         database (redis.Redis): The Redis client instance for database operations.
     """
-    prover_stats_keys = [stats_key async for stats_key in database.scan_iter("stats:*")]
-    tasks = [reset_request_stats(stats_key, database) for stats_key in prover_stats_keys]
-    await asyncio.gather(*tasks)
+    generation = await database.incr(GENERATION_KEY)
+    bt.logging.debug(f"Started stats interval generation {generation}")
 
 
 async def prover_is_registered(ss58_address: str, database: aioredis.Redis):
@@ -75,20 +80,27 @@ async def register_prover(ss58_address: str, database: aioredis.Redis, current_b
         ss58_address (str): The unique address (hotkey) of the prover to be registered.
         database (redis.Redis): The Redis client instance for database operations.
     """
-    # Initialize statistics for a new prover in a separate hash
+    if await scripting_available(database):
+        # Atomically, so concurrent forwards cannot both register and reset the prover.
+        await REGISTER_PROVER(
+            database,
+            [f"stats:{ss58_address}", PROVERS_KEY],
+            [TIER_CONFIG["Bronze"]["request_limit"], current_block, ss58_address],
+        )
+        return
+
+    # Initialize statistics for a new prover in a separate hash. Its interval counters start out absent,
+    # i.e. zero.
     await database.hmset(
         f"stats:{ss58_address}",
         {
-            "inference_attempts": 0,
-            "inference_successes": 0,
-            "challenge_successes": 0,
-            "challenge_attempts": 0,
             "total_successes": 0,
             "tier": "Bronze",
             "request_limit": TIER_CONFIG["Bronze"]["request_limit"],
             "last_interval_block": current_block, 
         },
     )
+    await database.sadd(PROVERS_KEY, ss58_address)
 
 
 async def update_statistics(
@@ -105,27 +117,42 @@ async def update_statistics(
         task_type (str): The type of task performed ('store', 'challenge', 'retrieve').
         database (redis.Redis): The Redis client instance for database operations.
     """
+    if await scripting_available(database):
+        # The whole read-modify-write in one atomic round trip.
+        await UPDATE_STATISTICS(
+            database,
+            [f"stats:{ss58_address}", PROVERS_KEY, GENERATION_KEY],
+            [
+                task_type, int(bool(success)), TIER_CONFIG["Bronze"]["request_limit"], current_block, ss58_address,
+                INTERVAL_PREFIX, INTERVAL_TTL,
+            ],
+        )
+        return
+
     # Check and see if this prover is registered.
     if not await prover_is_registered(ss58_address, database):
         bt.logging.debug(f"Registering new prover {ss58_address}...")
         await register_prover(ss58_address, database, current_block)
 
-    # Update statistics in the stats hash
+    # Update statistics in the stats hash and the current interval's counters
     stats_key = f"stats:{ss58_address}"
 
     if task_type in ["inference", "challenge"]:
-        await database.hincrby(stats_key, f"{task_type}_attempts", 1)
+        interval = interval_key(await current_generation(database), ss58_address)
+        await database.hincrby(interval, f"{task_type}_attempts", 1)
         if success:
-            await database.hincrby(stats_key, f"{task_type}_successes", 1)
+            await database.hincrby(interval, f"{task_type}_successes", 1)
 
             # --- add to total_interval_successes
-            await database.hincrby(stats_key, "total_interval_successes", 1)
+            await database.hincrby(interval, "total_interval_successes", 1)
+        await database.expire(interval, INTERVAL_TTL)
 
 
-    # Update the total successes that we rollover every epoch
+    # Update the total successes that we rollover every epoch. Provers registered before the total was
+    # tracked still have their counters in the stats hash.
     if await database.hget(stats_key, "total_successes") == None:
-        inference_successes = int(await database.hget(stats_key, "inference_successes"))
-        challenge_successes = int(await database.hget(stats_key, "challenge_successes"))
+        inference_successes = int(await database.hget(stats_key, "inference_successes") or 0)
+        challenge_successes = int(await database.hget(stats_key, "challenge_successes") or 0)
         total_successes = inference_successes + challenge_successes
         await database.hset(stats_key, "total_successes", total_successes)
     if success:
@@ -133,6 +160,92 @@ async def update_statistics(
 
 
 
+async def update_statistics_batch(
+    results: List[Tuple[str, bool]], task_type: str, database: aioredis.Redis, current_block: int
+) -> Tuple[List[float], int]:
+    """
+    Does what `update_statistics` followed by `get_tier_factor` does for every (hotkey, success) pair of a
+    forward pass. With scripting that is one pipeline of UPDATE_STATISTICS scripts, otherwise two round trips
+    however many provers were queried: one pipeline reads which provers are registered and the fields their
+    update depends on, one transaction registers the new ones, applies every update and reads back the tiers.
+
+    Args:
+        results (List[Tuple[str, bool]]): The hotkey of every queried prover and whether its task succeeded.
+        task_type (str): The type of task performed ('inference', 'challenge').
+        database (redis.Redis): The Redis client instance for database operations.
+        current_block (int): The block new provers are registered at.
+    Returns:
+        Tuple[List[float], int]: The reward factor of every prover's tier after the update, in the order of
+            `results`, and the number of Redis commands sent.
+    """
+    if not results:
+        return [], 0
+
+    if await scripting_available(database):
+        tiers, ops = await run_pipelined(database, [
+            (
+                UPDATE_STATISTICS,
+                [f"stats:{hotkey}", PROVERS_KEY, GENERATION_KEY],
+                [
+                    task_type, int(bool(success)), TIER_CONFIG["Bronze"]["request_limit"], current_block, hotkey,
+                    INTERVAL_PREFIX, INTERVAL_TTL,
+                ],
+            )
+            for hotkey, success in results
+        ])
+        return [tier_reward_factor(tier) for tier in tiers], ops
+
+    hotkeys = list(dict.fromkeys(hotkey for hotkey, _ in results))
+
+    async with database.pipeline(transaction=False) as pipe:
+        pipe.get(GENERATION_KEY)
+        for hotkey in hotkeys:
+            pipe.exists(f"stats:{hotkey}")
+            pipe.hmget(f"stats:{hotkey}", "inference_successes", "challenge_successes", "total_successes")
+        generation, *state = await pipe.execute()
+    generation = int(generation or 0)
+    ops = len(state) + 1
+
+    async with database.pipeline(transaction=True) as pipe:
+        for index, hotkey in enumerate(hotkeys):
+            registered, (inference_successes, challenge_successes, total_successes) = state[2 * index], state[2 * index + 1]
+            stats_key = f"stats:{hotkey}"
+            if not registered:
+                bt.logging.debug(f"Registering new prover {hotkey}...")
+                pipe.hmset(
+                    stats_key,
+                    {
+                        "total_successes": 0,
+                        "tier": "Bronze",
+                        "request_limit": TIER_CONFIG["Bronze"]["request_limit"],
+                        "last_interval_block": current_block,
+                    },
+                )
+                pipe.sadd(PROVERS_KEY, hotkey)
+            elif total_successes is None:
+                # Backfill the total for provers registered before it was tracked.
+                pipe.hset(stats_key, "total_successes", int(inference_successes or 0) + int(challenge_successes or 0))
+
+        tier_positions = []
+        for hotkey, success in results:
+            stats_key = f"stats:{hotkey}"
+            if task_type in ["inference", "challenge"]:
+                interval = interval_key(generation, hotkey)
+                pipe.hincrby(interval, f"{task_type}_attempts", 1)
+                if success:
+                    pipe.hincrby(interval, f"{task_type}_successes", 1)
+                    pipe.hincrby(interval, "total_interval_successes", 1)
+                pipe.expire(interval, INTERVAL_TTL)
+            if success:
+                pipe.hincrby(stats_key, "total_successes", 1)
+            tier_positions.append(len(pipe))
+            pipe.hget(stats_key, "tier")
+        replies = await pipe.execute()
+    ops += len(replies)
+
+    return [tier_reward_factor(replies[position]) for position in tier_positions], ops
+
+
 async def get_similarity_threshold(ss58_address: str, database: aioredis.Redis):
     """
     Retrieves the similarity threshold based on the tier of a given prover.
@@ -172,13 +285,13 @@ async def compute_tier(stats_key: str, database: aioredis.Redis, current_block:
         stats_key (str): The key representing the prover's statistics in the database.
         database (redis.Redis): The Redis client instance for database operations.
     """
-
     if not await database.exists(stats_key):
         bt.logging.warning(f"Prover key {stats_key} is not registered!")
         return
 
-    challenge_successes = int(await database.hget(stats_key, "challenge_successes") or 0)
-    challenge_attempts = int(await database.hget(stats_key, "challenge_attempts") or 0)
+    interval = interval_key(await current_generation(database), stats_key.split(":", 1)[1])
+    challenge_successes = int(await database.hget(interval, "challenge_successes") or 0)
+    challenge_attempts = int(await database.hget(interval, "challenge_attempts") or 0)
     challenge_success_rate = challenge_successes / challenge_attempts if challenge_attempts > 0 else 0
     total_successes = int(await database.hget(stats_key, "total_successes") or 0)
     last_interval_block = int(await database.hget(stats_key, "last_interval_block") or 0)
@@ -241,15 +354,123 @@ async def compute_tier(stats_key: str, database: aioredis.Redis, current_block:
             await database.hset(stats_key, "total_successes", TIER_CONFIG[new_tier_name]["request_limit"])
 
         # set the total_successes to 
+def compute_new_tiers(
+    success_rates: np.ndarray,
+    total_successes: np.ndarray,
+    current_tiers: np.ndarray,
+) -> np.ndarray:
+    """
+    Applies `compute_tier`'s promotion and demotion rules to every prover at once.
+
+    A prover is promoted to the lowest tier above its own whose success rate and request limit it beats, and
+    otherwise demoted to the highest tier below its own whose success rate and request limit it does not
+    exceed.
+
+    Args:
+        success_rates (np.ndarray): Every prover's challenge success rate.
+        total_successes (np.ndarray): Every prover's total successes.
+        current_tiers (np.ndarray): Every prover's tier, as an index into `TIER_NAMES`.
+    Returns:
+        np.ndarray: Every prover's new tier index.
+    """
+    tier_indices = np.arange(len(TIER_NAMES))[None, :]
+    current = current_tiers[:, None]
+    rates = success_rates[:, None]
+    totals = total_successes[:, None]
+
+    promotable = (tier_indices > current) & (rates > TIER_SUCCESS_RATES) & (totals > TIER_REQUEST_LIMITS)
+    promotion = np.where(promotable, tier_indices, len(TIER_NAMES)).min(axis=1)
+
+    demotable = (tier_indices < current) & (rates <= TIER_SUCCESS_RATES) & (totals <= TIER_REQUEST_LIMITS)
+    demotion = np.where(demotable, tier_indices, -1).max(axis=1)
+
+    return np.where(
+        promotion < len(TIER_NAMES), promotion, np.where(demotion >= 0, demotion, current_tiers)
+    )
+
+
 async def compute_all_tiers(database: aioredis.Redis, current_block: int):
     """
     Asynchronously computes and updates the tiers for all provers in the decentralized storage system.
     This function should be called periodically to ensure provers' tiers are up-to-date based on
-    their performance. It iterates over all provers and calls `compute_tier` for each one.
+    their performance. It applies the rules of `compute_tier` to every prover: the stats are read in one
+    pipeline, the new tiers computed with `compute_new_tiers` and only the changed fields written back in a
+    second pipeline.
     """
-    provers = [prover async for prover in database.scan_iter("stats:*")]
-    tasks = [compute_tier(prover, database, current_block) for prover in provers]
-    await asyncio.gather(*tasks)
+    hotkeys = await get_prover_hotkeys(database)
+    generation = await current_generation(database)
+
+    async with database.pipeline(transaction=False) as pipe:
+        for hotkey in hotkeys:
+            pipe.hmget(interval_key(generation, hotkey), "challenge_successes", "challenge_attempts")
+            pipe.hmget(f"stats:{hotkey}", "total_successes", "last_interval_block", "tier")
+        replies = await pipe.execute()
+
+    # Leave out registered provers whose stats were deleted.
+    provers, stats = [], []
+    for index, hotkey in enumerate(hotkeys):
+        counters, row = replies[2 * index], replies[2 * index + 1]
+        if any(row):
+            provers.append(f"stats:{hotkey}")
+            stats.append(counters + row)
+    if not provers:
+        return
+
+    def column(index):
+        return np.array([int(row[index] or 0) for row in stats], dtype=np.int64)
+
+    challenge_successes, challenge_attempts = column(0), column(1)
+    total_successes, last_interval_blocks = column(2), column(3)
+    current_tiers = np.empty(len(provers), dtype=np.int64)
+    for index, (prover, row) in enumerate(zip(provers, stats)):
+        tier = row[4].decode() if row[4] is not None else None
+        if tier not in TIER_INDEX:
+            bt.logging.error(f"No tier found for {prover}, setting to default 'Bronze'.")
+            tier = "Bronze"
+        current_tiers[index] = TIER_INDEX[tier]
+
+    success_rates = np.divide(
+        challenge_successes, challenge_attempts,
+        out=np.zeros(len(provers)), where=challenge_attempts > 0,
+    )
+    new_tiers = compute_new_tiers(success_rates, total_successes, current_tiers)
+    epoch_due = current_block - last_interval_blocks >= EPOCH_LENGTH
+
+    async with database.pipeline(transaction=False) as pipe:
+        for index in np.flatnonzero((new_tiers != current_tiers) | epoch_due | (last_interval_blocks == 0)):
+            prover, tier = provers[index], TIER_NAMES[new_tiers[index]]
+            fields = {}
+            if new_tiers[index] != current_tiers[index]:
+                fields.update(tier=tier, request_limit=TIER_CONFIG[tier]["request_limit"])
+            if last_interval_blocks[index] == 0:
+                fields["last_interval_block"] = current_block
+            if epoch_due[index] and new_tiers[index] < 2:
+                # Like `compute_tier`, which writes the Bronze reset to the stats key's own "stats:" key.
+                pipe.hmset(
+                    f"stats:{prover}",
+                    {
+                        "inference_attempts": 0,
+                        "inference_successes": 0,
+                        "challenge_successes": 0,
+                        "challenge_attempts": 0,
+                        "total_successes": 0,
+                        "tier": "Bronze",
+                        "request_limit": TIER_CONFIG["Bronze"]["request_limit"],
+                        "last_interval_block": current_block,
+                    },
+                )
+            elif epoch_due[index]:
+                fields.update(
+                    tier=tier,
+                    request_limit=TIER_CONFIG[tier]["request_limit"],
+                    last_interval_block=current_block,
+                    total_successes=TIER_CONFIG[tier]["request_limit"],
+                )
+            if fields:
+                pipe.hmset(prover, fields)
+        writes = len(pipe)
+        await pipe.execute()
+    bt.logging.debug(f"Computed the tiers of {len(provers)} provers, {writes} updated")
 
     bt.logging.info(f"Resetting statistics for all hotkeys...")
     await rollover_request_stats(database)
@@ -267,12 +488,13 @@ async def get_uid_tier_mapping(database: aioredis.Redis):
         dict: A dictionary mapping UIDs to their tiers.
     """
     uid_tier_mapping = {}
-    stats_keys = [key async for key in database.scan_iter("stats:*")]
-    for key in stats_keys:
-        ss58_address = key.decode().split(":")[1]
-        tier = await database.hget(key, "tier")
-        if tier is not None:
-            uid_tier_mapping[ss58_address] = tier.decode()
+    hotkeys = await get_prover_hotkeys(database)
+    async with database.pipeline(transaction=False) as pipe:
+        for ss58_address in hotkeys:
+            pipe.hget(f"stats:{ss58_address}", "tier")
+        for ss58_address, tier in zip(hotkeys, await pipe.execute()):
+            if tier is not None:
+                uid_tier_mapping[ss58_address] = tier.decode()
     return uid_tier_mapping
 
 
@@ -289,7 +511,9 @@ async def get_remaining_requests(ss58_address: str, database: aioredis.Redis):
     """
     request_limit = int(await database.hget(f"stats:{ss58_address}", "request_limit"))
     total_interval_successes = int(
-        await database.hget(f"stats:{ss58_address}", "total_interval_successes")
+        await database.hget(
+            interval_key(await current_generation(database), ss58_address), "total_interval_successes"
+        ) or 0
     )
     return request_limit - total_interval_successes
 
@@ -306,6 +530,13 @@ async def get_tier_factor(ss58_address: str, database: aioredis.Redis):
     """
     # Retrieve the tier from the database
     tier_bytes = await database.hget(f"stats:{ss58_address}", "tier")
+    return tier_reward_factor(tier_bytes)
+
+
+def tier_reward_factor(tier_bytes) -> float:
+    """
+    Returns the reward factor of the tier stored in a prover's stats, `tier_bytes` as read from Redis.
+    """
     if tier_bytes is None:
         # If the tier is not found, return a default reward factor
         return BRONZE_TIER_REWARD_FACTOR
@@ -0,0 +1,158 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import time
+import asyncio
+import typing
+import collections
+import bittensor as bt
+
+from fractal import protocol
+
+
+# Seconds a capability query may take; a prover that cannot answer it quickly is not worth waiting on.
+CAPABILITY_TIMEOUT = 5
+# A prover's request timeout is its p95 latency times this, within the bounds below.
+TIMEOUT_HEADROOM = 1.5
+# Number of recent successful answers per prover its observed latency is computed over.
+OBSERVED_WINDOW = 32
+# A prover seen busy is left out of at most this many rounds in a row before it is challenged again.
+MAX_SKIPPED_ROUNDS = 3
+# Timeouts never grow beyond this multiple of --neuron.timeout.
+MAX_TIMEOUT_FACTOR = 3
+
+
+class CapabilityCache:
+    """
+    The last `Capabilities` answer of every prover, keyed by uid and dropped when the uid changes hands.
+
+    Entries older than `ttl` seconds are refreshed before the prover is queried again. Provers that never
+    answered, e.g. ones running an older release, keep the configured defaults.
+
+    Next to what provers report, it keeps how long the verifier saw every prover take to answer successfully,
+    which bounds what a prover's report can earn it, and which provers it last saw busy.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.entries = {}
+        # uid -> (hotkey, recent latencies)
+        self.observed = {}
+        # uid -> (hotkey, rounds it may still be left out of), for provers last seen busy
+        self.busy = {}
+
+    def get(self, uid: int, hotkey: str) -> typing.Optional[protocol.Capabilities]:
+        entry = self.entries.get(uid)
+        if entry is None or entry[1] != hotkey:
+            return None
+        return entry[2]
+
+    def stale(self, uid: int, hotkey: str) -> bool:
+        entry = self.entries.get(uid)
+        return entry is None or entry[1] != hotkey or time.monotonic() - entry[0] > self.ttl
+
+    async def refresh(self, neuron, uids: typing.Iterable[int]):
+        """
+        Queries the capabilities of those of `uids` whose entry is stale, all at once.
+
+        Args:
+            neuron: The verifier, for its dendrite and metagraph.
+            uids (Iterable[int]): The uids about to be queried.
+        """
+        uids = [
+            int(uid) for uid in uids
+            if self.stale(int(uid), neuron.metagraph.hotkeys[int(uid)])
+        ]
+        if not uids:
+            return
+
+        responses = await asyncio.gather(*[
+            neuron.dendrite(
+                neuron.metagraph.axons[uid],
+                protocol.Capabilities(),
+                deserialize=False,
+                timeout=CAPABILITY_TIMEOUT,
+            )
+            for uid in uids
+        ])
+        now = time.monotonic()
+        for uid, response in zip(uids, responses):
+            hotkey = neuron.metagraph.hotkeys[uid]
+            if response.max_concurrency is None:
+                # Remember the miss so a prover without the route is not asked again every round.
+                self.entries[uid] = (now, hotkey, None)
+                continue
+            bt.logging.trace(
+                f"Capabilities of prover {uid}: concurrency {response.max_concurrency}, queue {response.queue_depth}, "
+                f"p50/p95 {response.latency_p50}/{response.latency_p95}, profiles {response.profiles}"
+            )
+            self.entries[uid] = (now, hotkey, response)
+
+    def observe(self, uid: int, hotkey: str, seconds: typing.Optional[float]):
+        """Records that `uid` answered a request successfully in `seconds`."""
+        if seconds is None:
+            return
+        entry = self.observed.get(uid)
+        if entry is None or entry[0] != hotkey:
+            entry = self.observed[uid] = (hotkey, collections.deque(maxlen=OBSERVED_WINDOW))
+        entry[1].append(seconds)
+
+    def observed_percentile(self, uid: int, hotkey: str, q: float) -> typing.Optional[float]:
+        """Returns the q-th percentile of `uid`'s recent successful answers, or None before the first."""
+        entry = self.observed.get(uid)
+        if entry is None or entry[0] != hotkey or not entry[1]:
+            return None
+        latencies = sorted(entry[1])
+        return latencies[min(len(latencies) - 1, int(q / 100 * len(latencies)))]
+
+    def timeout(self, uid: int, hotkey: str, default: float) -> float:
+        """
+        Returns the timeout to query `uid` with: `default`, raised to fit the prover's p95 latency up to
+        `MAX_TIMEOUT_FACTOR` times `default`. The p95 the prover reports counts for no more than the p95 of the
+        answers the verifier saw it give, so a prover cannot claim more time than it was seen to need.
+        Timeouts are never shortened below `default`, so a prover that just answered fast is not cut off by a
+        single slow render.
+        """
+        capabilities = self.get(uid, hotkey)
+        observed = self.observed_percentile(uid, hotkey, 95)
+        if capabilities is None or capabilities.latency_p95 is None or observed is None:
+            return default
+        p95 = min(capabilities.latency_p95, observed)
+        return min(max(default, p95 * TIMEOUT_HEADROOM), default * MAX_TIMEOUT_FACTOR)
+
+    def record(self, uid: int, hotkey: str, busy: bool):
+        """Records whether `uid` answered busy or timed out, as seen by the verifier."""
+        if busy:
+            self.busy[uid] = (hotkey, MAX_SKIPPED_ROUNDS)
+        else:
+            self.busy.pop(uid, None)
+
+    def skipped(self, neuron) -> typing.List[int]:
+        """
+        Returns the uids to leave out of this round: provers the verifier saw answer busy or time out. What
+        provers report about their queue plays no part, so a prover cannot opt out of challenges. A prover is
+        left out of at most `MAX_SKIPPED_ROUNDS` rounds in a row; call once per round.
+        """
+        skipped = []
+        for uid, (hotkey, rounds) in list(self.busy.items()):
+            if uid >= len(neuron.metagraph.hotkeys) or neuron.metagraph.hotkeys[uid] != hotkey or rounds <= 0:
+                del self.busy[uid]
+                continue
+            self.busy[uid] = (hotkey, rounds - 1)
+            skipped.append(uid)
+        return skipped
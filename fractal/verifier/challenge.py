@@ -20,7 +20,9 @@ import time
 import torch
 import random
 import typing
+import base64
 import string
+import hashlib
 import asyncio
 import bittensor as bt
 
@@ -28,7 +30,7 @@ from fractal import protocol
 from fractal.verifier.event import EventSchema
 from fractal.constants import CHALLENGE_FAILURE_REWARD
 from fractal.utils.uids import get_random_uids
-from fractal.verifier.bonding import update_statistics, get_tier_factor
+from fractal.verifier.bonding import update_statistics_batch
 from fractal.verifier.reward import hashing_function, apply_reward_scores
 
 
@@ -59,7 +61,67 @@ def verify( self, output, ground_truth_hash):
     )
     return True
 
-async def handle_challenge( self, uid: int, private_input: typing.Dict, ground_truth_hash: str, sampling_params: protocol.ChallengeSamplingParams ) -> typing.Tuple[bool, protocol.Challenge]:
+async def verify_stream( self, uid: int, synapse: protocol.StreamingChallenge, ground_truth_hash: str, ground_truth_chunks: typing.List[str] ) -> typing.Tuple[bool, protocol.StreamingChallenge]:
+    """
+    Streams the challenge's completion from a prover and checks every chunk against the ground truth as it
+    arrives, hanging up at the first chunk that does not match. Only the chunk being checked is held.
+
+    Returns:
+    - Tuple[Optional[bool], protocol.StreamingChallenge]: Whether the whole completion matched, None if the
+      prover streamed nothing (its busy answer), and the synapse with the dendrite's timing and status.
+    """
+    start_time = time.time()
+    hasher = hashlib.sha256()
+    received = 0
+    response = synapse
+
+    stream = await self.dendrite(
+        self.metagraph.axons[uid],
+        synapse,
+        deserialize=False,
+        timeout=self.capabilities.timeout(uid, self.metagraph.hotkeys[uid], self.config.neuron.timeout),
+        streaming=True,
+    )
+    try:
+        async for chunk in stream:
+            # The stream ends with the synapse, filled in from the response headers.
+            if isinstance(chunk, bt.Synapse):
+                response = chunk
+                continue
+            # Raw chunks re-encode to exactly the base64 chunks the ground truth digests cover.
+            encoded = base64.b64encode(chunk)
+            if received >= len(ground_truth_chunks) or hashlib.sha256(encoded).hexdigest() != ground_truth_chunks[received]:
+                bt.logging.debug(f"Chunk {received} from prover {uid} does not match the ground truth, hanging up")
+                response.dendrite.process_time = time.time() - start_time
+                response.dendrite.status_message = f"Chunk {received} does not match"
+                return False, response
+            hasher.update(encoded)
+            received += 1
+    finally:
+        await stream.aclose()
+
+    if received == 0:
+        bt.logging.debug(f"Prover {uid} streamed nothing")
+        return None, response
+    return received == len(ground_truth_chunks) and hasher.hexdigest() == ground_truth_hash, response
+
+async def handle_legacy_challenge( self, uid: int, private_input: typing.Dict, ground_truth_hash: str, sampling_params: protocol.ChallengeSamplingParams ) -> typing.Tuple[bool, protocol.Challenge]:
+    """
+    Challenges a prover that predates `ChallengeDigest` the way it expects: with a `Challenge`, whose whole
+    completion comes back in the response and is checked against the ground truth hash.
+    """
+    response = await self.dendrite(
+        self.metagraph.axons[uid],
+        protocol.Challenge(query=private_input["query"], sampling_params=sampling_params),
+        deserialize=False,
+        timeout=self.capabilities.timeout(uid, self.metagraph.hotkeys[uid], self.config.neuron.timeout),
+    )
+    if response.busy:
+        bt.logging.debug(f"Prover {uid} is busy")
+        return False, (response, uid)
+    return verify( self, response.completion, ground_truth_hash ), (response, uid)
+
+async def handle_challenge( self, uid: int, private_input: typing.Dict, ground_truth_hash: str, ground_truth_chunks: typing.List[str], sampling_params: protocol.ChallengeSamplingParams ) -> typing.Tuple[bool, protocol.Challenge]:
     """
     Handles a challenge sent to a prover and verifies the response.
 
@@ -71,25 +133,48 @@ async def handle_challenge( self, uid: int, private_input: typing.Dict, ground_t
     """
 
     hotkey = self.metagraph.hotkeys[uid]
-    keys = await self.database.hkeys(f"hotkey:{hotkey}")
-    bt.logging.trace(f"{len(keys)} stats pulled for hotkey {hotkey}")
 
     if not self.config.mock:
-        synapse = protocol.Challenge(
-            query = private_input["query"],
-            sampling_params=sampling_params,
-        )
-
+        # Commit: the prover answers with the digest of its completion.
         response = await self.dendrite(
             self.metagraph.axons[uid],
-            synapse,
+            protocol.ChallengeDigest(query=private_input["query"], sampling_params=sampling_params),
             deserialize=False,
-            timeout=self.config.neuron.timeout,
+            timeout=self.capabilities.timeout(uid, hotkey, self.config.neuron.timeout),
+        )
+        if response.dendrite.status_code == 404:
+            # The axon has no ChallengeDigest route: a prover that was not upgraded yet.
+            bt.logging.debug(f"Prover {uid} does not answer digests, sending it a Challenge")
+            return await handle_legacy_challenge( self, uid, private_input, ground_truth_hash, sampling_params )
+        if response.busy:
+            bt.logging.debug(f"Prover {uid} is busy")
+            return False, (response, uid)
+        if response.digest is None:
+            return False, (response, uid)
+        if response.digest != ground_truth_hash:
+            # Wrong whatever the payload would be; not worth fetching.
+            bt.logging.debug(f"Digest {response.digest} does not match ground truth hash {ground_truth_hash}")
+            return False, (response, uid)
+        if random.random() >= self.config.neuron.reveal_probability:
+            bt.logging.debug(f"Digest {response.digest} matches ground truth hash {ground_truth_hash}")
+            return True, (response, uid)
+
+        # Reveal, for a random share of rounds: the payload must hash to the digest the prover committed to.
+        synapse = protocol.StreamingChallenge(
+            query = private_input["query"],
+            sampling_params=sampling_params,
         )
 
-        output = response.completion
-        
-        verified = verify( self, output, ground_truth_hash )
+        # Only the verdict comes from the reveal. It streams a completion the prover has cached, so its timing
+        # would make revealed provers look faster than the others; they are all timed on their digest.
+        verified, _ = await verify_stream( self, uid, synapse, response.digest, ground_truth_chunks )
+        if verified is None:
+            # Nothing streamed is a busy prover, not a forged payload.
+            bt.logging.debug(f"Prover {uid} is busy for the reveal")
+            response.busy = True
+            verified = False
+        elif not verified:
+            bt.logging.debug(f"Prover {uid} revealed a payload that does not match its digest")
 
         output_dict = (
             response,
@@ -105,8 +190,7 @@ async def handle_challenge( self, uid: int, private_input: typing.Dict, ground_t
         )
 
 
-        response = await self.client.generate(prompt, sampling_params.seed)
-        await self.client.close_session()
+        response = await self.client.generate(private_input["query"], sampling_params.seed)
 
         synapse.completion = response
 
@@ -152,32 +236,37 @@ async def challenge_data( self ):
     )
 
     hotkey = self.wallet.hotkey.ss58_address 
-    prompt = generate_challenge(self)
+    if self.ground_truth is not None:
+        # --- Take a ground truth rendered ahead of time
+        prompt, seed, ground_truth_hash, ground_truth_chunks = await self.ground_truth.pop()
+    else:
+        prompt = generate_challenge(self)
+        seed = random.randint(1, 2**32 - 1)
+
+        # --- Generate the ground truth hash, hashed while it streams in without keeping the video around
+        ground_truth_hash, ground_truth_chunks = await self.client.generate_chunk_digests(
+            prompt, seed, protocol.STREAM_CHUNK_CHARS
+        )
     private_input = {'query': prompt}
-    seed = random.randint(1, 2**32 - 1)
 
 
     sampling_params = protocol.ChallengeSamplingParams(
         seed=seed,
     )
 
-    # --- Generate the ground truth output
-    ground_truth_output = await self.client.generate(prompt, seed) 
-    await self.client.close_session()
-
-    # --- get hashing function
-    ground_truth_hash = hashing_function(ground_truth_output)
-
     # --- Get the uids to query
     start_time = time.time()
     tasks = []
     # uids = await get_tiered_uids( self, k=self.config.neuron.sample_size )
-    uids = get_random_uids( self, k=self.config.neuron.sample_size )
+    # Leave out provers that were busy lately, unless there are not enough others.
+    uids = get_random_uids( self, k=self.config.neuron.sample_size, exclude=self.capabilities.skipped(self) )
+    if not self.config.mock:
+        await self.capabilities.refresh(self, uids)
 
     bt.logging.debug(f"challenge uids {uids}")
     responses = []
     for uid in uids:
-        tasks.append(asyncio.create_task(handle_challenge(self, uid, private_input, ground_truth_hash, sampling_params)))
+        tasks.append(asyncio.create_task(handle_challenge(self, uid, private_input, ground_truth_hash, ground_truth_chunks, sampling_params)))
     responses = await asyncio.gather(*tasks)
 
 
@@ -185,26 +274,23 @@ async def challenge_data( self ):
         self.device
     )
 
+    # Update the challenge statistics of every prover and read back their tiers in one batch
+    tier_factors, event.database_ops = await update_statistics_batch(
+        [(self.metagraph.hotkeys[uid], verified) for verified, (_, uid) in responses],
+        task_type="challenge",
+        database=self.database,
+        current_block=self.block,
+    )
+    bt.logging.trace(f"challenge_data() sent {event.database_ops} database commands for {len(responses)} responses")
+
     remove_reward_idxs = []
     for i, (verified, (response, uid)) in enumerate(responses):
         bt.logging.trace(
-            f"Challenge iteration {i} uid {uid} response {str(response.completion if not self.config.mock else response)}"
-        )
-
-        hotkey = self.metagraph.hotkeys[uid]
-
-        # Update the challenge statistics
-        await update_statistics(
-            ss58_address=hotkey,
-            success=verified,
-            task_type="challenge",
-            database=self.database,
-            current_block=self.block,
+            f"Challenge iteration {i} uid {uid} response {str(getattr(response, 'digest', None) or getattr(response, 'completion', None) if not self.config.mock else response)}"
         )
 
         # Apply reward for this challenge
-        tier_factor = await get_tier_factor(hotkey, self.database)
-        rewards[i] = 1.0 * tier_factor if verified else CHALLENGE_FAILURE_REWARD
+        rewards[i] = 1.0 * tier_factors[i] if verified else CHALLENGE_FAILURE_REWARD
 
         if self.config.mock:
             event.uids.append(uid)
@@ -214,10 +300,17 @@ async def challenge_data( self ):
             event.task_status_codes.append(0)
             event.rewards.append(rewards[i].item())
         else: 
+            if verified:
+                self.capabilities.observe(uid, self.metagraph.hotkeys[uid], response.dendrite.process_time)
+            self.capabilities.record(
+                uid,
+                self.metagraph.hotkeys[uid],
+                busy=getattr(response, "busy", False) or response.dendrite.status_code == 408,
+            )
             event.uids.append(uid)
             event.successful.append(verified)
             event.completion_times.append(response.dendrite.process_time)
-            event.task_status_messages.append(response.dendrite.status_message)
+            event.task_status_messages.append("Busy" if getattr(response, "busy", False) else response.dendrite.status_message)
             event.task_status_codes.append(response.dendrite.status_code)
             event.rewards.append(rewards[i].item())
 
@@ -24,6 +24,79 @@ import bittensor as bt
 from typing import Dict, List, Any, Union, Optional, Tuple
 
 
+# Set of the hotkeys of every registered prover, so bulk operations do not scan the keyspace for stats keys.
+PROVERS_KEY = "provers"
+# Set once the registry was filled from the stats keys of a database that predates it.
+PROVERS_BACKFILLED_KEY = "provers:backfilled"
+
+# The counters that start from zero every stats interval live in "interval:<generation>:<hotkey>" hashes
+# rather than in the prover's stats hash. Rolling the interval over bumps the generation; the hashes of old
+# generations are no longer read and expire INTERVAL_TTL seconds after their last update.
+GENERATION_KEY = "interval:generation"
+INTERVAL_PREFIX = "interval:"
+INTERVAL_TTL = 7 * 24 * 60 * 60
+INTERVAL_FIELDS = (
+    "inference_attempts",
+    "inference_successes",
+    "challenge_successes",
+    "challenge_attempts",
+    "total_interval_successes",
+)
+
+
+def interval_key(generation: int, ss58_address: str) -> str:
+    return f"{INTERVAL_PREFIX}{generation}:{ss58_address}"
+
+
+async def current_generation(database: aioredis.Redis) -> int:
+    """Returns the generation of the current stats interval."""
+    return int(await database.get(GENERATION_KEY) or 0)
+
+
+async def get_prover_hotkeys(database: aioredis.Redis) -> List[str]:
+    """
+    Returns the hotkeys of all registered provers from the registry set. The first call against a database
+    from before the registry was kept fills the registry from its stats keys, even if provers registered or
+    updated since the upgrade are in the set already.
+
+    Parameters:
+        database (aioredis.Redis): The Redis client instance.
+
+    Returns:
+        The hotkeys, sorted.
+    """
+    async with database.pipeline(transaction=False) as pipe:
+        pipe.smembers(PROVERS_KEY)
+        pipe.exists(PROVERS_BACKFILLED_KEY)
+        hotkeys, backfilled = await pipe.execute()
+    hotkeys = {hotkey.decode() if isinstance(hotkey, bytes) else hotkey for hotkey in hotkeys}
+    if not backfilled:
+        hotkeys.update(await backfill_prover_registry(database))
+    return sorted(hotkeys)
+
+
+async def backfill_prover_registry(database: aioredis.Redis) -> List[str]:
+    """
+    Adds the hotkey of every stats key to the registry set, scanning the keyspace once.
+
+    Parameters:
+        database (aioredis.Redis): The Redis client instance.
+
+    Returns:
+        The hotkeys found.
+    """
+    hotkeys = [key.decode().split(":", 1)[1] async for key in database.scan_iter(b"stats:*")]
+    # Hotkeys hold no colons; stats:stats:<hotkey> keys are leftovers of an old epoch reset bug.
+    hotkeys = [hotkey for hotkey in hotkeys if ":" not in hotkey]
+    bt.logging.info(f"Backfilling the prover registry with {len(hotkeys)} hotkeys")
+    async with database.pipeline(transaction=True) as pipe:
+        if hotkeys:
+            pipe.sadd(PROVERS_KEY, *hotkeys)
+        pipe.set(PROVERS_BACKFILLED_KEY, 1)
+        await pipe.execute()
+    return hotkeys
+
+
 
 async def get_metadata_for_hotkey_and_hash(
     ss58_address: str, data_hash: str, database: aioredis.Redis, verbose: bool = False
@@ -198,11 +271,13 @@ async def total_verifier_requests(database: aioredis.Redis) -> int:
         The total request used by all hotkeys in the database in bytes.
     """
     total_requests = 0
-    async for key in database.scan_iter("stats:*"):
-        # Get the total storage used by the hotkey
-        total_successes = await database.hget(key, "total_successes")
-        if total_successes is not None:
-            total_requests += int(total_successes)
+    hotkeys = await get_prover_hotkeys(database)
+    async with database.pipeline(transaction=False) as pipe:
+        for hotkey in hotkeys:
+            pipe.hget(f"stats:{hotkey}", "total_successes")
+        for total_successes in await pipe.execute():
+            if total_successes is not None:
+                total_requests += int(total_successes)
     return total_requests
 
 async def get_prover_statistics(database: aioredis.Redis) -> Dict[str, Dict[str, str]]:
@@ -214,14 +289,23 @@ async def get_prover_statistics(database: aioredis.Redis) -> Dict[str, Dict[str,
         A dictionary where keys are hotkeys and values are dictionaries containing the statistics for each hotkey.
     """
     stats = {}
-    async for key in database.scan_iter(b"stats:*"):
-        # Await the hgetall call and then process its result
-        key_stats = await database.hgetall(key)
-        # Process the key_stats as required
-        processed_stats = {
+    hotkeys = await get_prover_hotkeys(database)
+    generation = await current_generation(database)
+    async with database.pipeline(transaction=False) as pipe:
+        for hotkey in hotkeys:
+            pipe.hgetall(f"stats:{hotkey}")
+            pipe.hgetall(interval_key(generation, hotkey))
+        replies = await pipe.execute()
+    for index, hotkey in enumerate(hotkeys):
+        key_stats, interval_stats = replies[2 * index], replies[2 * index + 1]
+        if not key_stats:
+            continue
+        # The current interval's counters, zero until the prover is queried in it.
+        key_stats.update({field.encode(): b"0" for field in INTERVAL_FIELDS})
+        key_stats.update(interval_stats)
+        stats[hotkey] = {
             k.decode("utf-8"): v.decode("utf-8") for k, v in key_stats.items()
         }
-        stats[key.decode("utf-8").split(":")[-1]] = processed_stats
 
     return stats
 
@@ -44,6 +44,9 @@ class EventSchema:
     set_weights: Optional[List[List[float]]] = None
     moving_averaged_scores: Optional[List[float]] = None
 
+    # Database commands sent to record the step's results
+    database_ops: Optional[int] = None
+
     @staticmethod
     def from_dict(event_dict: dict) -> "EventSchema":
         """Converts a dictionary to an EventSchema object."""
@@ -62,4 +65,5 @@ class EventSchema:
             rewards=event_dict["rewards"],
             set_weights=event_dict["set_weights"],
             moving_averaged_scores=event_dict["moving_averaged_scores"],
+            database_ops=event_dict.get("database_ops"),
         )
\ No newline at end of file
@@ -90,6 +90,9 @@ async def forward(self):
 
     total_request_size = await total_verifier_requests(self.database)
     bt.logging.info(f"total verifier requests: {total_request_size}")
+    bt.logging.debug(f"model endpoints: {self.client.stats()}")
+    if self.ground_truth is not None:
+        bt.logging.debug(f"ground truth queue: {self.ground_truth.stats()}")
 
     sleep_time = 12 - (time.time() - start_time)
     if sleep_time > 0:
@@ -0,0 +1,169 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import json
+import time
+import random
+import asyncio
+import typing
+import collections
+import bittensor as bt
+
+from fractal import __version__
+
+
+# Redis list holding the ready ground truths, oldest first.
+GROUND_TRUTH_KEY = "groundtruth:queue"
+# Ground truths older than this are thrown away instead of used. Ones rendered by another release are thrown
+# away regardless of their age, since an update may change the model or how it renders.
+GROUND_TRUTH_MAX_AGE = 24 * 60 * 60
+# Seconds the producer sleeps while the queue is full, and after a failed render.
+REFILL_INTERVAL = 5
+# Number of recent renders the refill rate is computed over.
+RATE_WINDOW = 32
+
+
+class GroundTruth(typing.NamedTuple):
+    prompt: str
+    seed: int
+    hash: str
+    chunks: typing.List[str]
+
+
+class GroundTruthQueue:
+    """
+    A bounded queue of rendered challenges, kept in Redis so it survives restarts.
+
+    A producer task renders (prompt, seed) pairs on the verifier's model endpoint in the background and
+    pushes their hash and chunk digests while the queue holds fewer than `size`, so a forward pass pops a
+    ready ground truth instead of waiting for a render. When the queue runs dry the caller renders inline,
+    as before.
+
+    The producer is started on the first `pop`, inside the event loop the forward passes run in, which owns
+    the model client's session.
+    """
+
+    def __init__(self, database, client, make_prompt: typing.Callable[[], str], chunk_size: int, size: int):
+        self.database = database
+        self.client = client
+        self.make_prompt = make_prompt
+        self.chunk_size = chunk_size
+        self.size = size
+        self.low_watermark = max(1, size // 4)
+        self.task = None
+        self.loop = None
+
+        self.produced = 0
+        self.failed = 0
+        self.popped = 0
+        self.expired = 0
+        self.low_events = 0
+        self.empty_events = 0
+        self.render_time = None
+        self.render_times = collections.deque(maxlen=RATE_WINDOW)
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.task is not None and not self.task.done() and self.loop is loop:
+            return
+        self.loop = loop
+        self.task = loop.create_task(self.produce())
+
+    def stop(self):
+        if self.task is None or self.loop is None or self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.task = None
+
+    async def produce(self):
+        while True:
+            try:
+                if await self.database.llen(GROUND_TRUTH_KEY) >= self.size:
+                    await asyncio.sleep(REFILL_INTERVAL)
+                    continue
+                ground_truth = await self.render()
+                await self.database.rpush(
+                    GROUND_TRUTH_KEY, json.dumps({**ground_truth._asdict(), "created": time.time(), "version": __version__})
+                )
+                self.produced += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                bt.logging.warning(f"Failed to render a ground truth in the background: {e}")
+                await asyncio.sleep(REFILL_INTERVAL)
+
+    async def render(self) -> GroundTruth:
+        """Renders a fresh challenge and returns its ground truth."""
+        prompt = self.make_prompt()
+        seed = random.randint(1, 2**32 - 1)
+        start = time.monotonic()
+        ground_truth_hash, ground_truth_chunks = await self.client.generate_chunk_digests(
+            prompt, seed, self.chunk_size
+        )
+        self.render_times.append(time.monotonic())
+        elapsed = time.monotonic() - start
+        self.render_time = elapsed if self.render_time is None else 0.2 * elapsed + 0.8 * self.render_time
+        return GroundTruth(prompt, seed, ground_truth_hash, ground_truth_chunks)
+
+    async def pop(self) -> GroundTruth:
+        """
+        Returns the oldest ready ground truth, or renders one inline when none is left. Ground truths that are
+        too old or were rendered by another release are dropped.
+        """
+        self.start()
+        while True:
+            entry = await self.database.lpop(GROUND_TRUTH_KEY)
+            if entry is None:
+                break
+            entry = json.loads(entry)
+            if entry.get("version") != __version__ or time.time() - entry["created"] > GROUND_TRUTH_MAX_AGE:
+                self.expired += 1
+                continue
+            self.popped += 1
+            remaining = await self.database.llen(GROUND_TRUTH_KEY)
+            if remaining < self.low_watermark:
+                self.low_events += 1
+                bt.logging.warning(
+                    f"Ground truth queue is low: {remaining} of {self.size} left, "
+                    f"refilling at {self.refill_rate():.2f}/min"
+                )
+            return GroundTruth(entry["prompt"], entry["seed"], entry["hash"], entry["chunks"])
+
+        self.empty_events += 1
+        bt.logging.warning("Ground truth queue is empty, rendering inline")
+        return await self.render()
+
+    def refill_rate(self) -> float:
+        """Ground truths rendered per minute over the recent renders."""
+        if len(self.render_times) < 2:
+            return 0.0
+        return 60 * (len(self.render_times) - 1) / max(self.render_times[-1] - self.render_times[0], 1e-9)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "produced": self.produced,
+            "failed": self.failed,
+            "popped": self.popped,
+            "expired": self.expired,
+            "low_events": self.low_events,
+            "empty_events": self.empty_events,
+            "render_time": self.render_time,
+            "refill_rate": self.refill_rate(),
+        }
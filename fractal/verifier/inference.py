@@ -18,11 +18,13 @@
 
 import time
 import typing
+import base64
 import asyncio
 
 from fractal import protocol
 from fractal.utils.uids import get_tiered_uids
 from fractal.verifier.event import EventSchema
+from fractal.verifier.challenge import generate_challenge
 
 async def handle_inference(
         self, 
@@ -30,42 +32,35 @@ async def handle_inference(
         sampling_params: protocol.InferenceeSamplingParams, 
         uid: int
     ):
+    """
+    Streams an inference from a prover. Returns the synapse, with the raw video collected behind `video()`.
+    """
     if not self.config.mock:
-        synapse = protocol.Challenge(
-            sources = [private_input["sources"]],
+        synapse = protocol.Inference(
             query = private_input["query"],
             sampling_params=sampling_params,
         )
 
-        async for token in await self.dendrite(
+        async for chunk in await self.dendrite(
             self.metagraph.axons[uid],
             synapse,
             deserialize=False,
-            timeout=self.config.neuron.timeout,
+            timeout=self.capabilities.timeout(uid, self.metagraph.hotkeys[uid], self.config.neuron.timeout),
+            streaming=True,
         ):
-            print(token)
+            # Chunks are collected into the synapse, which comes last.
+            if isinstance(chunk, protocol.Inference):
+                synapse = chunk
 
     else:
-        prompt = private_input
-        async for token in await self.client.text_generation(
-            prompt=prompt,
-            best_of=sampling_params.best_of,
-            max_new_tokens=sampling_params.max_new_tokens,
-            seed=sampling_params.seed,
-            do_sample=sampling_params.do_sample,
-            repetition_penalty=sampling_params.repetition_penalty,
-            temperature=sampling_params.temperature,
-            top_k=sampling_params.top_k,
-            top_p=sampling_params.top_p,
-            truncate=sampling_params.truncate,
-            typical_p=sampling_params.typical_p,
-            watermark=sampling_params.watermark,
-            details=sampling_params.details,
-            stream=False
-        ):
-            print(token)
+        synapse = protocol.Inference(
+            query = private_input["query"],
+            sampling_params=sampling_params,
+        )
+        completion = await self.client.generate(private_input["query"], sampling_params.seed)
+        synapse._video.extend(base64.b64decode(completion))
 
-    return None
+    return synapse
 
 async def inference_data(
         self
@@ -91,9 +86,15 @@ async def inference_data(
 
     uids, _ = await get_tiered_uids(self, k=10)
 
+    private_input = {"query": generate_challenge(self)}
+    sampling_params = protocol.InferenceeSamplingParams()
+
+    if not self.config.mock:
+        await self.capabilities.refresh(self, uids)
+
     tasks = []
     for uid in uids:
-        tasks.append(asyncio.create_task(handle_inference(self, uid)))
+        tasks.append(asyncio.create_task(handle_inference(self, private_input, sampling_params, uid)))
     response_tuples = await asyncio.gather(*tasks)
     return event
 
@@ -0,0 +1,164 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import hashlib
+import weakref
+import bittensor as bt
+
+
+# Set to False to always take the command by command fallbacks, e.g. to compare both.
+SCRIPTS_ENABLED = True
+
+SCRIPTS = []
+
+# Whether each database client's server runs scripts, probed on first use.
+_scripting = weakref.WeakKeyDictionary()
+
+
+def is_noscript(e) -> bool:
+    """Whether `e` reports a script missing from the server's cache, after SCRIPT FLUSH or a restart."""
+    return type(e).__name__ == "NoScriptError"
+
+
+class RedisScript:
+    """
+    A Lua script run atomically on the Redis server with EVALSHA. The script is loaded into the server's
+    script cache by `scripting_available`, and loaded again if the cache was flushed since.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode()).hexdigest()
+        SCRIPTS.append(self)
+
+    async def __call__(self, database, keys, args):
+        try:
+            return await database.evalsha(self.sha, len(keys), *keys, *args)
+        except Exception as e:
+            if not is_noscript(e):
+                raise
+            await database.script_load(self.source)
+            return await database.evalsha(self.sha, len(keys), *keys, *args)
+
+    def queue(self, pipe, keys, args):
+        """Queues the script on a pipeline. The script must be loaded already; see `run_pipelined`."""
+        pipe.evalsha(self.sha, len(keys), *keys, *args)
+
+
+async def run_pipelined(database, calls):
+    """
+    Runs `calls`, (script, keys, args) triples, in one pipeline and returns their results in order. Calls that
+    found their script missing from the server's cache did nothing; they are run again, once, after every
+    script is loaded. Calls that did run are not repeated.
+
+    Returns:
+        Tuple[list, int]: The results, and the number of commands sent.
+    """
+    async with database.pipeline(transaction=False) as pipe:
+        for script, keys, args in calls:
+            script.queue(pipe, keys, args)
+        results = await pipe.execute(raise_on_error=False)
+    ops = len(results)
+
+    missing = [index for index, result in enumerate(results) if is_noscript(result)]
+    if missing:
+        bt.logging.debug(f"Redis lost its scripts, loading them and retrying {len(missing)} calls")
+        for script in SCRIPTS:
+            await database.script_load(script.source)
+        async with database.pipeline(transaction=False) as pipe:
+            for index in missing:
+                script, keys, args = calls[index]
+                script.queue(pipe, keys, args)
+            for index, result in zip(missing, await pipe.execute(raise_on_error=False)):
+                results[index] = result
+        ops += len(SCRIPTS) + len(missing)
+
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results, ops
+
+
+async def scripting_available(database) -> bool:
+    """
+    Returns whether `database` runs Lua scripts, loading every script into its cache the first time. Servers
+    without scripting, such as some in-memory fakes used in tests, make callers take their fallbacks.
+    """
+    if not SCRIPTS_ENABLED:
+        return False
+    available = _scripting.get(database)
+    if available is None:
+        try:
+            for script in SCRIPTS:
+                await database.script_load(script.source)
+            available = True
+        except Exception as e:
+            if "unknown command" not in str(e).lower():
+                raise
+            bt.logging.warning(f"Redis does not run scripts, updating statistics command by command: {e}")
+            available = False
+        _scripting[database] = available
+    return available
+
+
+# KEYS[1]: the prover's stats hash, KEYS[2]: the prover registry set. ARGV: the Bronze request limit, the
+# current block, the prover's hotkey.
+# Registers the prover unless it is registered already. Returns 1 if it was registered now.
+REGISTER_PROVER = RedisScript("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1],
+    'total_successes', 0, 'tier', 'Bronze', 'request_limit', ARGV[1], 'last_interval_block', ARGV[2])
+redis.call('SADD', KEYS[2], ARGV[3])
+return 1
+""")
+
+# KEYS[1]: the prover's stats hash, KEYS[2]: the prover registry set, KEYS[3]: the interval generation.
+# ARGV: the task type, 1 if the task succeeded else 0, the Bronze request limit, the current block, the
+# prover's hotkey, the interval hash prefix, the interval hash TTL.
+# Registers the prover if needed and records the task. Returns the prover's tier.
+# The interval hash is named after the generation read here, so it is not declared in KEYS; fine on a single
+# Redis server, which is all the verifier supports.
+UPDATE_STATISTICS = RedisScript("""
+local key = KEYS[1]
+local success = ARGV[2] == '1'
+if redis.call('EXISTS', key) == 0 then
+    redis.call('HSET', key,
+        'total_successes', 0, 'tier', 'Bronze', 'request_limit', ARGV[3], 'last_interval_block', ARGV[4])
+    redis.call('SADD', KEYS[2], ARGV[5])
+end
+if ARGV[1] == 'inference' or ARGV[1] == 'challenge' then
+    local interval = ARGV[6] .. (redis.call('GET', KEYS[3]) or '0') .. ':' .. ARGV[5]
+    redis.call('HINCRBY', interval, ARGV[1] .. '_attempts', 1)
+    if success then
+        redis.call('HINCRBY', interval, ARGV[1] .. '_successes', 1)
+        redis.call('HINCRBY', interval, 'total_interval_successes', 1)
+    end
+    redis.call('EXPIRE', interval, ARGV[7])
+end
+if redis.call('HEXISTS', key, 'total_successes') == 0 then
+    local inference = tonumber(redis.call('HGET', key, 'inference_successes')) or 0
+    local challenge = tonumber(redis.call('HGET', key, 'challenge_successes')) or 0
+    redis.call('HSET', key, 'total_successes', inference + challenge)
+end
+if success then
+    redis.call('HINCRBY', key, 'total_successes', 1)
+end
+return redis.call('HGET', key, 'tier')
+""")
@@ -2,16 +2,41 @@ import torch
 from diffusers import DiffusionPipeline, DPMSolverMultistepScheduler
 from diffusers.utils import export_to_video
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+import json
 import base64
 import sys
+import asyncio
+import argparse
 import numpy as np
 import random
+from typing import List, Optional
 from loguru import logger
 
+from fractal.utils.shm import SharedMemoryRing, DEFAULT_NUM_SLOTS, DEFAULT_SLOT_SIZE
+from fractal.utils.generation import GenerationQueue, error_status
+
 class GenerationRequest(BaseModel):
     seed: int
     text: str
+    # "shm" asks for the video to be left in shared memory instead of returned base64 encoded.
+    transport: Optional[str] = None
+    # Seconds the caller is still willing to wait. Orders the queue; requests that cannot make it are dropped.
+    budget: Optional[float] = None
+    # Name of the pipeline settings to render with, see PROFILES.
+    profile: str = "default"
+
+class BatchJob(BaseModel):
+    seed: int
+    text: str
+    profile: str = "default"
+
+class BatchGenerationRequest(BaseModel):
+    jobs: List[BatchJob]
+    transport: Optional[str] = None
+    # Shared by every job of the batch.
+    budget: Optional[float] = None
 
 app = FastAPI()
 
@@ -19,47 +44,167 @@ app = FastAPI()
 logger.remove()
 logger.add(sys.stdout, colorize=True, format="<green>{time}</green> <level>{message}</level>")
 
-pipe = DiffusionPipeline.from_pretrained("damo-vilab/text-to-video-ms-1.7b", torch_dtype=torch.float16, variant="fp16")
-pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
-pipe.enable_model_cpu_offload()
+# Loaded in __main__, so the app can be imported (e.g. by tests) without loading the model.
+pipe = None
+
+def load_pipeline():
+    global pipe
+    pipe = DiffusionPipeline.from_pretrained("damo-vilab/text-to-video-ms-1.7b", torch_dtype=torch.float16, variant="fp16")
+    pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
+    pipe.enable_model_cpu_offload()
+
+# Created in __main__ when serving on a unix domain socket.
+shared_ring = None
+
+# Pipeline settings a request can ask for by name. Verifier and prover must render a challenge with the same
+# profile for the hashes to match.
+PROFILES = {
+    "default": {"num_inference_steps": 25},
+    "draft": {"num_inference_steps": 10},
+}
 
 def preprocess_text(text, limit=76):
     tokens = text.split()[:limit]
     return ' '.join(tokens)
 
+# Created on startup inside the serving loop.
+generation_queue = None
+
+@app.on_event("startup")
+async def start_generation_queue():
+    global generation_queue
+    generation_queue = GenerationQueue(render)
+    asyncio.get_running_loop().create_task(generation_queue.run())
+
+def render(seed, text, profile="default"):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    torch.cuda.manual_seed_all(seed)
+    prompt = preprocess_text(text)
+
+    video_frames = pipe(prompt, **PROFILES[profile]).frames
+    video_path = export_to_video(video_frames)
+
+    with open(video_path, 'rb') as video_file:
+        video_data = video_file.read()
+
+    torch.cuda.empty_cache()
+    return video_data
+
+def fixed_render(payload_size):
+    """Returns a render that answers every request with the same payload right away, to benchmark transports."""
+    video_data = np.random.bytes(payload_size)
+
+    def render(seed, text, profile="default"):
+        return video_data
+
+    return render
+
+@app.get('/health')
+async def health():
+    return {
+        'status': 'ok',
+        'queue_depth': len(generation_queue.heap) if generation_queue else 0,
+        'service_time': generation_queue.service_time if generation_queue else None,
+        'profiles': list(PROFILES),
+    }
+
+def encode_video(video_data, transport=None):
+    if transport == "shm" and shared_ring is not None and len(video_data) <= shared_ring.max_payload:
+        return {'shm': shared_ring.write(video_data)}
+
+    video_base64_encoded = base64.b64encode(video_data)
+    video_base64_string = video_base64_encoded.decode('utf-8')
+
+    return {'completion': video_base64_string}
+
+def check_profile(profile):
+    if profile not in PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile {profile}, expected one of {list(PROFILES)}")
+
 @app.post('/generate')
 async def generate(request_data: GenerationRequest):
+    check_profile(request_data.profile)
     try:
-        seed = request_data.seed
-        random.seed(seed)
-        np.random.seed(seed)
-        torch.manual_seed(seed)
-        torch.cuda.manual_seed_all(seed)
-        prompt = preprocess_text(request_data.text)
-
-        video_frames = pipe(prompt, num_inference_steps=25).frames
-        video_path = export_to_video(video_frames)
-
-        with open(video_path, 'rb') as video_file:
-            video_data = video_file.read()
-
-        video_base64_encoded = base64.b64encode(video_data)
-        video_base64_string = video_base64_encoded.decode('utf-8')
-
-        torch.cuda.empty_cache()
-
-        return {'completion': video_base64_string}
-    except RuntimeError as e:
-        if "CUDA out of memory" in str(e):
-            logger.error("CUDA out of memory. Consider reducing the request rate or payload size.")
-            raise HTTPException(status_code=503, detail="CUDA out of memory. Try again later.")
-        else:
-            logger.exception("An error occurred during request processing - Runtime")
-            raise HTTPException(status_code=500, detail=str(e))
+        video_data = await generation_queue.submit(
+            request_data.seed, request_data.text, request_data.budget, request_data.profile
+        )
+        return encode_video(video_data, request_data.transport)
     except Exception as e:
-        logger.exception("An error occurred during request processing")
-        raise HTTPException(status_code=500, detail=str(e))
+        status, detail = error_status(e)
+        raise HTTPException(status_code=status, detail=detail)
+
+@app.post('/generate_batch')
+async def generate_batch(request_data: BatchGenerationRequest):
+    """
+    Queues every job of the batch and streams one JSON line per job as soon as it is rendered, in completion
+    order: {"index": i, "completion": ...} (or "shm"), or {"index": i, "status": ..., "detail": ...} on failure.
+    Jobs are rendered one at a time like /generate requests so each video stays identical to its single
+    request rendering.
+    """
+    for job in request_data.jobs:
+        check_profile(job.profile)
+
+    futures = {
+        generation_queue.submit(job.seed, job.text, request_data.budget, job.profile): index
+        for index, job in enumerate(request_data.jobs)
+    }
+
+    async def results():
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    result = {'index': futures[future]}
+                    if future.exception() is None:
+                        result.update(encode_video(future.result(), request_data.transport))
+                    else:
+                        result['status'], result['detail'] = error_status(future.exception())
+                    yield json.dumps(result) + "\n"
+        finally:
+            # The caller went away; leave its remaining jobs unrendered.
+            for future in pending:
+                future.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 if __name__ == '__main__':
+    import os
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=5005)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5005, help="TCP port to serve on.")
+    parser.add_argument(
+        "--uds",
+        type=str,
+        default=None,
+        help="Serve on this unix domain socket instead of TCP. Point the neuron at unix://<path>.",
+    )
+    parser.add_argument("--shm_slots", type=int, default=DEFAULT_NUM_SLOTS, help="Number of shared memory slots.")
+    parser.add_argument("--shm_slot_size", type=int, default=DEFAULT_SLOT_SIZE, help="Size of a shared memory slot in bytes.")
+    parser.add_argument(
+        "--stub_payload_size",
+        type=int,
+        default=None,
+        help="Skip the model and answer every request with this many fixed bytes. For benchmarking transports.",
+    )
+    args = parser.parse_args()
+
+    if args.stub_payload_size is None:
+        load_pipeline()
+    else:
+        render = fixed_render(args.stub_payload_size)
+        logger.info(f"Serving a fixed {args.stub_payload_size} byte payload instead of rendering")
+    if args.uds is None:
+        uvicorn.run(app, host="0.0.0.0", port=args.port)
+    else:
+        if os.path.exists(args.uds):
+            os.remove(args.uds)
+        shared_ring = SharedMemoryRing(slot_size=args.shm_slot_size, num_slots=args.shm_slots, create=True)
+        logger.info(f"Serving on {args.uds} with shared memory segment {shared_ring.name}")
+        try:
+            uvicorn.run(app, uds=args.uds)
+        finally:
+            shared_ring.close()
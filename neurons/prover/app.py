@@ -17,14 +17,30 @@
 # DEALINGS IN THE SOFTWARE.
 
 import time
-import sys 
-import os
+import base64
+import collections
 import typing
 import bittensor as bt
 
 from fractal.base.prover import BaseProverNeuron
-from fractal.base.client import HttpClient
-from fractal.protocol import Inference, Challenge
+from fractal.base.client import HttpClient, ModelClientError
+from fractal.prover.scheduler import StakeScheduler, SchedulerError, QueueFullError, ProverBusyError
+from fractal.prover.cache import CompletionCache
+from fractal.prover.ratelimit import StakeRateLimiter
+from fractal.prover.telemetry import REQUEST_TIMINGS
+from fractal.protocol import (
+    Inference,
+    Challenge,
+    Capabilities,
+    ChallengeDigest,
+    StreamingChallenge,
+    StreamingVideoSynapse,
+    STREAM_CHUNK_CHARS,
+)
+from fractal.verifier.reward import hashing_function
+
+# Number of recent model requests the latencies advertised in `Capabilities` are computed over.
+LATENCY_WINDOW = 256
 
 class Prover(BaseProverNeuron):
     """
@@ -37,30 +53,98 @@ class Prover(BaseProverNeuron):
 
     def __init__(self, config=None):
         super(Prover, self).__init__(config=config)
-        self.client = HttpClient(self.config.neuron.model_endpoint)
+        self.client = HttpClient(
+            self.config.neuron.model_endpoint,
+            pool_size=self.config.neuron.model_pool_size,
+            timeout=self.config.neuron.model_timeout,
+            strategy=self.config.neuron.model_balancing,
+            hedge_percentile=self.config.neuron.model_hedge_percentile,
+            failure_threshold=self.config.neuron.model_failure_threshold,
+            reset_timeout=self.config.neuron.model_reset_timeout,
+            health_interval=self.config.neuron.model_health_interval,
+        )
+        self.scheduler = StakeScheduler(
+            max_concurrency=self.config.neuron.max_concurrency,
+            max_queue=self.config.neuron.max_queue,
+            aging=self.config.neuron.queue_aging,
+        )
+        self.cache = CompletionCache(
+            max_bytes=int(self.config.neuron.cache_size_mb * 1024 * 1024),
+            ttl=self.config.neuron.cache_ttl,
+        )
+        self.rate_limiter = StakeRateLimiter(
+            rate=self.config.blacklist.rate_limit,
+            min_rate=self.config.blacklist.rate_limit_min,
+            burst=self.config.blacklist.rate_limit_burst,
+        )
+        # Seconds taken by recently served requests, busy answers left out.
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.telemetry.register_gauges("queue", self.scheduler.stats)
+        self.telemetry.register_gauges("cache", self.cache.stats)
+        self.telemetry.register_gauges("rate_limit", self.rate_limiter.stats)
+
+        self.axon.attach(
+            forward_fn=self.forward_digest,
+            blacklist_fn=self.blacklist_digest,
+            priority_fn=self.priority_digest,
+        ).attach(
+            forward_fn=self.forward_inference,
+            blacklist_fn=self.blacklist_inference,
+            priority_fn=self.priority_inference,
+        ).attach(
+            forward_fn=self.forward_streaming_challenge,
+            blacklist_fn=self.blacklist_streaming_challenge,
+            priority_fn=self.priority_streaming_challenge,
+        ).attach(
+            forward_fn=self.forward_capabilities,
+            blacklist_fn=self.blacklist_capabilities,
+            priority_fn=self.priority_capabilities,
+        )
 
-    async def inference_request(
-            self, synapse: Inference
-    ):
-        """
-        Sends an inference request to the prover's model endpoint.
+    def shutdown(self):
+        super(Prover, self).shutdown()
+        self.client.close()
 
-        Args:
-            synapse (typing.Union[Challenge, Inference]): The synapse object containing the request data.
+    def prepare_worker(self, index: int, num_workers: int):
+        super(Prover, self).prepare_worker(index, num_workers)
+        # Every worker sees part of the requests; together they accept the configured rates.
+        self.rate_limiter.scale(1 / num_workers)
 
-        Returns:
-            typing.Tuple[bool, str]: A tuple containing a boolean indicating whether the request was successful,
-                                    and a string containing the response from the prover's model endpoint.
+    def update_snapshot(self, snapshot):
+        super(Prover, self).update_snapshot(snapshot)
+        self.rate_limiter.prune(snapshot.uids)
 
-        This function is a placeholder and should be replaced with a call to your prover's model endpoint.
+    async def generate_completion(self, synapse: Challenge, waiters) -> str:
         """
-        output = await self.client.generate(synapse.query, synapse.sampling_params.seed)
-        await self.client.close_session()
-
-        synapse.completion = output
-
-        return synapse
-
+        Waits for a model slot, ahead of callers with less stake and for as long as the verifiers wait for us,
+        then requests the completion from the model endpoint. `waiters` are the callers coalesced on the
+        completion; it is scheduled with the highest stake and longest budget among them.
+        """
+        labels = (type(synapse).__name__, self.caller_label(synapse.dendrite.hotkey))
+        # Answer busy straight away rather than let the verifier wait out its timeout for a late answer. Not for
+        # a reveal: it follows a digest the verifier accepted and, when this worker has no cached completion to
+        # stream, waits its turn rather than fail a round the prover already answered correctly.
+        if not isinstance(synapse, StreamingChallenge):
+            self.scheduler.check(waiters.stake, waiters.budget())
+        queued_at = time.perf_counter()
+        async with self.scheduler.slot(waiters=waiters):
+            self.telemetry.observe("queue", *labels, time.perf_counter() - queued_at)
+            with self.telemetry.timer("model", *labels):
+                completion = await self.client.generate(
+                    synapse.query, synapse.sampling_params.seed, budget=waiters.budget()
+                )
+        # Only renders are advertised: cache hits and response construction say nothing about the model.
+        self.latencies.append(time.perf_counter() - queued_at)
+        return completion
+
+    async def cached_completion(self, synapse: Challenge) -> str:
+        """Returns the completion for `synapse`, from the cache or generated for it and concurrent callers."""
+        return await self.cache.get_or_generate(
+            (synapse.query, synapse.sampling_params.seed),
+            lambda waiters: self.generate_completion(synapse, waiters),
+            stake=self.caller_stake(synapse),
+            budget=self.remaining_budget(synapse),
+        )
 
     async def challenge_request(
             self, synapse: Challenge
@@ -78,8 +162,7 @@ class Prover(BaseProverNeuron):
         This function is a placeholder and should be replaced with a call to your prover's model endpoint.
         """
 
-        output = await self.client.generate(synapse.query, synapse.sampling_params.seed)
-        await self.client.close_session()
+        output = await self.cached_completion(synapse)
 
         synapse.completion = output
 
@@ -100,10 +183,149 @@ class Prover(BaseProverNeuron):
         The 'forward' function is a placeholder and should be overridden with logic that is appropriate for
         the prover's intended operation. This method demonstrates a basic transformation of input data.
         """
-        if isinstance(synapse, Inference):
-            return await self.inference_request(synapse)
-    
-        return await self.challenge_request(synapse)
+        return await self.serve(synapse, self.challenge_request)
+
+    async def forward_inference(
+        self, synapse: Inference
+    ) -> Inference.BTStreamingResponse:
+        """Streams the completion of an inference request back in chunks."""
+        return await self.serve(synapse, self.stream_request)
+
+    async def forward_streaming_challenge(
+        self, synapse: StreamingChallenge
+    ) -> StreamingChallenge.BTStreamingResponse:
+        """Streams the completion of a challenge back in chunks, for the verifier to check as they arrive."""
+        return await self.serve(synapse, self.stream_request)
+
+    async def stream_request(self, synapse: StreamingVideoSynapse):
+        try:
+            completion = await self.cached_completion(synapse)
+        except (ProverBusyError, QueueFullError) as e:
+            # A streaming response has no busy field; an empty stream tells the caller straight away.
+            bt.logging.debug(f"Busy, streaming nothing to {synapse.dendrite.hotkey}: {e}")
+            completion = ""
+
+        async def stream(send):
+            # Decoded chunk by chunk: every STREAM_CHUNK_CHARS of base64 decode on their own.
+            for start in range(0, len(completion), STREAM_CHUNK_CHARS):
+                await send({
+                    "type": "http.response.body",
+                    "body": base64.b64decode(completion[start:start + STREAM_CHUNK_CHARS]),
+                    "more_body": True,
+                })
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+        return synapse.create_streaming_response(stream)
+
+    async def forward_digest(
+        self, synapse: ChallengeDigest
+    ) -> ChallengeDigest:
+        """
+        Answers the commit half of a commit-then-reveal challenge with the digest of the completion. The
+        completion stays cached for the `Challenge` that may follow to reveal it.
+        """
+        return await self.serve(synapse, self.digest_request)
+
+    async def digest_request(self, synapse: ChallengeDigest):
+        completion = await self.cached_completion(synapse)
+
+        synapse.digest = hashing_function(completion)
+
+        return synapse
+
+    async def forward_capabilities(
+        self, synapse: Capabilities
+    ) -> Capabilities:
+        """
+        Reports the load the prover can take. With several axon workers every worker bounds its own model
+        requests, so the concurrency is the sum over them while the queue and latencies are this worker's.
+        """
+        synapse.max_concurrency = self.scheduler.max_concurrency * max(1, self.config.neuron.axon_workers)
+        synapse.profiles = self.client.profiles()
+        synapse.queue_depth = len(self.scheduler.queue)
+        synapse.latency_p50 = self.latency_percentile(50)
+        synapse.latency_p95 = self.latency_percentile(95)
+        return synapse
+
+    def latency_percentile(self, q: float):
+        """Returns the q-th percentile of recent model request latencies, or None before the first one."""
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(q / 100 * len(latencies)))]
+
+    async def serve(self, synapse, handler):
+        """
+        Runs `handler` on `synapse`, answering busy when the prover cannot make the synapse's timeout, and
+        records the request's timings.
+        """
+        start = time.perf_counter()
+        labels = (type(synapse).__name__, self.caller_label(synapse.dendrite.hotkey))
+        since_sent = self.time_since_sent(synapse)
+        if since_sent is not None:
+            self.telemetry.observe("receive", *labels, since_sent)
+
+        try:
+            return await handler(synapse)
+
+        except (ProverBusyError, QueueFullError) as e:
+            bt.logging.debug(f"Busy, not serving {synapse.dendrite.hotkey}: {e}")
+            synapse.busy = True
+            return synapse
+
+        except SchedulerError as e:
+            bt.logging.debug(f"Not serving {synapse.dendrite.hotkey}: {e}")
+            raise
+
+        # Fail the request straight away rather than answering with an error message as the completion.
+        except ModelClientError as e:
+            bt.logging.warning(f"Model request for {synapse.dendrite.hotkey} failed: {e}")
+            raise
+
+        finally:
+            elapsed = time.perf_counter() - start
+            self.telemetry.observe("forward", *labels, elapsed)
+            timings = REQUEST_TIMINGS.get()
+            if timings is not None:
+                timings["forward"] = elapsed
+
+    def caller_stake(self, synapse: Challenge) -> float:
+        """Returns the stake of the synapse's caller, 0 for hotkeys not in the metagraph."""
+        return self.snapshot.stake(synapse.dendrite.hotkey)
+
+    # The axon infers a route's synapse type from the annotations of its functions, so the digest route
+    # needs its own typed blacklist and priority.
+    async def blacklist_digest(
+        self, synapse: ChallengeDigest
+    ) -> typing.Tuple[bool, str]:
+        return await self.blacklist(synapse)
+
+    async def priority_digest(self, synapse: ChallengeDigest) -> float:
+        return await self.priority(synapse)
+
+    async def blacklist_inference(
+        self, synapse: Inference
+    ) -> typing.Tuple[bool, str]:
+        return await self.blacklist(synapse)
+
+    async def priority_inference(self, synapse: Inference) -> float:
+        return await self.priority(synapse)
+
+    async def blacklist_streaming_challenge(
+        self, synapse: StreamingChallenge
+    ) -> typing.Tuple[bool, str]:
+        return await self.blacklist(synapse)
+
+    async def priority_streaming_challenge(self, synapse: StreamingChallenge) -> float:
+        return await self.priority(synapse)
+
+    async def blacklist_capabilities(
+        self, synapse: Capabilities
+    ) -> typing.Tuple[bool, str]:
+        return await self.blacklist(synapse)
+
+    async def priority_capabilities(self, synapse: Capabilities) -> float:
+        return await self.priority(synapse)
 
     async def blacklist(
         self, synapse: Challenge
@@ -137,13 +359,27 @@ class Prover(BaseProverNeuron):
 
         Otherwise, allow the request to be processed further.
         """
-        if synapse.dendrite.hotkey not in self.metagraph.hotkeys:
+        snapshot = self.snapshot
+        if not self.config.blacklist.allow_non_registered and not snapshot.is_registered(synapse.dendrite.hotkey):
             # Ignore requests from unrecognized entities.
             bt.logging.trace(
                 f"Blacklisting unrecognized hotkey {synapse.dendrite.hotkey}"
             )
             return True, "Unrecognized hotkey"
 
+        if self.config.blacklist.force_verifier_permit and not snapshot.has_permit(synapse.dendrite.hotkey):
+            bt.logging.trace(
+                f"Blacklisting hotkey {synapse.dendrite.hotkey} without a verifier permit"
+            )
+            return True, "No verifier permit"
+
+        stake_share = snapshot.stake(synapse.dendrite.hotkey) / snapshot.total_stake if snapshot.total_stake else 0.0
+        if not self.rate_limiter.allow(synapse.dendrite.hotkey, stake_share):
+            bt.logging.trace(
+                f"Blacklisting hotkey {synapse.dendrite.hotkey} over its rate limit"
+            )
+            return True, "Rate limited"
+
         bt.logging.trace(
             f"Not Blacklisting recognized hotkey {synapse.dendrite.hotkey}"
         )
@@ -169,13 +405,7 @@ class Prover(BaseProverNeuron):
         Example priority logic:
         - A higher stake results in a higher priority value.
         """
-        # TODO(developer): Define how miners should prioritize requests.
-        caller_uid = self.metagraph.hotkeys.index(
-            synapse.dendrite.hotkey
-        )  # Get the caller index.
-        prirority = float(
-            self.metagraph.S[caller_uid]
-        )  # Return the stake as the priority.
+        prirority = self.snapshot.stake(synapse.dendrite.hotkey)  # Return the stake as the priority.
         bt.logging.trace(
             f"Prioritizing {synapse.dendrite.hotkey} with value: ", prirority
         )
@@ -187,6 +417,12 @@ if __name__ == "__main__":
     with Prover() as prover:
         while True:
             if prover.restart_required:
-                os.execv(sys.executable, [sys.executable] + sys.argv)
+                prover.handoff()
+            prover.check_workers()
             bt.logging.info("Prover running...", time.time())
+            bt.logging.trace(f"Model endpoints: {prover.client.stats()}")
+            bt.logging.debug(f"Request queue: {prover.scheduler.stats()}")
+            bt.logging.debug(f"Completion cache: {prover.cache.stats()}")
+            if prover.rate_limiter.enabled:
+                bt.logging.debug(f"Rate limits: {prover.rate_limiter.stats()}")
             time.sleep(5)
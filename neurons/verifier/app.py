@@ -18,8 +18,6 @@
 
 
 import time
-import sys 
-import os
 import bittensor as bt
 
 
@@ -27,6 +25,10 @@ from fractal.verifier.forward import forward
 from fractal.base.verifier import BaseVerifierNeuron
 from fractal.utils.uids import check_uid_availability
 from fractal.base.client import HttpClient
+from fractal.verifier.capability import CapabilityCache
+from fractal.verifier.groundtruth import GroundTruthQueue
+from fractal.verifier.challenge import generate_challenge
+from fractal import protocol
 
 
 class Verifier(BaseVerifierNeuron):
@@ -45,7 +47,30 @@ class Verifier(BaseVerifierNeuron):
                 check_uid_availability(self.metagraph, i, self.config.neuron.vpermit_tao_limit)
 
         # inference client
-        self.client = HttpClient(self.config.neuron.model_endpoint)
+        self.client = HttpClient(
+            self.config.neuron.model_endpoint,
+            pool_size=self.config.neuron.model_pool_size,
+            timeout=self.config.neuron.model_timeout,
+            strategy=self.config.neuron.model_balancing,
+            hedge_percentile=self.config.neuron.model_hedge_percentile,
+            failure_threshold=self.config.neuron.model_failure_threshold,
+            reset_timeout=self.config.neuron.model_reset_timeout,
+            health_interval=self.config.neuron.model_health_interval,
+        )
+
+        # Last reported capabilities of every prover, for timeouts and load.
+        self.capabilities = CapabilityCache(ttl=self.config.neuron.capability_ttl)
+
+        # Challenges rendered ahead of the forward passes that use them.
+        self.ground_truth = None
+        if not self.config.mock and self.config.neuron.ground_truth_queue > 0:
+            self.ground_truth = GroundTruthQueue(
+                self.database,
+                self.client,
+                make_prompt=lambda: generate_challenge(self),
+                chunk_size=protocol.STREAM_CHUNK_CHARS,
+                size=self.config.neuron.ground_truth_queue,
+            )
 
         # --- Block 
         self.last_interval_block = self.get_last_adjustment_block()
@@ -67,6 +92,12 @@ class Verifier(BaseVerifierNeuron):
     
         return await forward(self)
 
+    def shutdown(self):
+        super(Verifier, self).shutdown()
+        if self.ground_truth is not None:
+            self.ground_truth.stop()
+        self.client.close()
+
     def __enter__(self):
         
         if self.config.no_background_thread:
@@ -96,12 +127,13 @@ class Verifier(BaseVerifierNeuron):
             self.thread.join(5)
             self.is_running = False
             bt.logging.debug("Stopped")
+        self.shutdown()
 
 # The main function parses the configuration and runs the verifier.
 if __name__ == "__main__":
     with Verifier() as verifier:
         while True:
             if verifier.restart_required:
-                os.execv(sys.executable, [sys.executable] + sys.argv)
+                verifier.handoff()
             bt.logging.info("Verifier running...", time.time())
             time.sleep(5)
@@ -0,0 +1,99 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Compares the prover statistics updates of fractal/verifier/bonding.py run as Lua scripts against the command
+by command fallback, against a real Redis server:
+
+    python scripts/benchmark_bonding.py --password <password> --provers 1000 --updates 5000
+
+Both modes register the same number of provers, record `--updates` challenge results with
+`update_statistics` and compute every prover's tier with `compute_tier`, then once more all at once with
+`compute_all_tiers`. Reported are the wall time and throughput of each step. The benchmark only touches
+`benchmark-*` provers and deletes them afterwards; still, point it at a database index no verifier uses,
+since `compute_all_tiers` covers every prover in it and starts a new stats interval.
+"""
+
+import time
+import random
+import asyncio
+import argparse
+
+import aioredis
+
+from fractal.verifier import lua
+from fractal.verifier.database import PROVERS_KEY, GENERATION_KEY
+from fractal.verifier.bonding import update_statistics, compute_tier, compute_all_tiers
+
+PREFIX = "stats:benchmark-"
+
+
+async def cleanup(database):
+    keys = [key async for key in database.scan_iter(f"{PREFIX}*")]
+    keys += [key async for key in database.scan_iter("interval:*:benchmark-*")]
+    if keys:
+        await database.delete(*keys)
+    await database.delete(PROVERS_KEY, GENERATION_KEY)
+
+
+async def run(database, provers: int, updates: int, scripts: bool):
+    lua.SCRIPTS_ENABLED = scripts
+    await cleanup(database)
+    hotkeys = [f"benchmark-{i}" for i in range(provers)]
+    rng = random.Random(0)
+
+    start = time.perf_counter()
+    for _ in range(updates):
+        await update_statistics(rng.choice(hotkeys), rng.random() < 0.9, "challenge", database, current_block=1)
+    update_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for hotkey in hotkeys:
+        await compute_tier(f"stats:{hotkey}", database, current_block=2)
+    tier_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await compute_all_tiers(database, current_block=3)
+    all_tiers_time = time.perf_counter() - start
+    await cleanup(database)
+
+    print("lua scripts" if scripts else "command by command")
+    print(f"  update_statistics: {update_time:.2f} s, {updates / update_time:.0f} updates/s")
+    print(f"  compute_tier:      {tier_time:.2f} s, {provers / tier_time:.0f} provers/s")
+    print(f"  compute_all_tiers: {all_tiers_time * 1000:.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="localhost", help="Redis host.")
+    parser.add_argument("--port", type=int, default=6379, help="Redis port.")
+    parser.add_argument("--index", type=int, default=15, help="Redis database index to benchmark in.")
+    parser.add_argument("--password", type=str, default=None, help="Redis password.")
+    parser.add_argument("--provers", type=int, default=1000, help="Number of provers.")
+    parser.add_argument("--updates", type=int, default=5000, help="Number of challenge results recorded.")
+    args = parser.parse_args()
+
+    database = aioredis.StrictRedis(host=args.host, port=args.port, db=args.index, password=args.password)
+    if not await lua.scripting_available(database):
+        print("The server does not run Lua scripts.")
+    for scripts in (False, True):
+        await run(database, args.provers, args.updates, scripts)
+    await database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Compares walking the keyspace with SCAN "stats:*" against reading the prover registry set with pipelined
+reads, against a real Redis server:
+
+    python scripts/benchmark_registry.py --password <password> --provers 10000 --filler 100000
+
+The database index the benchmark runs in (15 by default) is filled with `--provers` prover stats hashes and
+`--filler` unrelated keys, and emptied of them afterwards; point it at an index no verifier uses. Reported is
+the wall time of summing every prover's total successes, as `total_verifier_requests` did before the
+registry and as it does now, and of `get_prover_statistics` and `compute_all_tiers` on the registry.
+"""
+
+import time
+import asyncio
+import argparse
+
+import aioredis
+
+from fractal.verifier.bonding import compute_all_tiers
+from fractal.verifier.database import (
+    PROVERS_KEY,
+    PROVERS_BACKFILLED_KEY,
+    GENERATION_KEY,
+    interval_key,
+    total_verifier_requests,
+    get_prover_statistics,
+)
+
+# Keys written per pipeline while filling the database.
+BATCH = 1000
+
+
+async def fill(database, provers: int, filler: int):
+    for start in range(0, provers, BATCH):
+        async with database.pipeline(transaction=False) as pipe:
+            for i in range(start, min(start + BATCH, provers)):
+                pipe.hmset(interval_key(0, f"benchmark-{i}"), {"challenge_successes": i % 100, "challenge_attempts": 100})
+                pipe.hmset(
+                    f"stats:benchmark-{i}",
+                    {
+                        "total_successes": i % 1000,
+                        "tier": "Bronze",
+                        "request_limit": 500,
+                        "last_interval_block": 1,
+                    },
+                )
+                pipe.sadd(PROVERS_KEY, f"benchmark-{i}")
+            await pipe.execute()
+    for start in range(0, filler, BATCH):
+        async with database.pipeline(transaction=False) as pipe:
+            for i in range(start, min(start + BATCH, filler)):
+                pipe.set(f"filler:{i}", i)
+            await pipe.execute()
+    await database.set(PROVERS_BACKFILLED_KEY, 1)
+
+
+async def cleanup(database):
+    for pattern in ("stats:benchmark-*", "interval:*:benchmark-*", "filler:*"):
+        keys = [key async for key in database.scan_iter(pattern, count=BATCH)]
+        for start in range(0, len(keys), BATCH):
+            await database.delete(*keys[start:start + BATCH])
+    await database.delete(PROVERS_KEY, PROVERS_BACKFILLED_KEY, GENERATION_KEY)
+
+
+async def scan_total_requests(database) -> int:
+    total_requests = 0
+    async for key in database.scan_iter("stats:*"):
+        total_successes = await database.hget(key, "total_successes")
+        if total_successes is not None:
+            total_requests += int(total_successes)
+    return total_requests
+
+
+async def timed(name, coroutine):
+    start = time.perf_counter()
+    result = await coroutine
+    print(f"  {name:<28} {(time.perf_counter() - start) * 1000:10.1f} ms")
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="localhost", help="Redis host.")
+    parser.add_argument("--port", type=int, default=6379, help="Redis port.")
+    parser.add_argument("--index", type=int, default=15, help="Redis database index to benchmark in.")
+    parser.add_argument("--password", type=str, default=None, help="Redis password.")
+    parser.add_argument("--provers", type=int, default=10000, help="Number of prover stats hashes.")
+    parser.add_argument("--filler", type=int, default=100000, help="Number of unrelated keys.")
+    args = parser.parse_args()
+
+    database = aioredis.StrictRedis(host=args.host, port=args.port, db=args.index, password=args.password)
+    await cleanup(database)
+    await fill(database, args.provers, args.filler)
+    try:
+        print(f"{args.provers} provers, {args.filler} unrelated keys")
+        scanned = await timed("scan total requests", scan_total_requests(database))
+        indexed = await timed("registry total requests", total_verifier_requests(database))
+        assert scanned == indexed, (scanned, indexed)
+        await timed("registry prover statistics", get_prover_statistics(database))
+        await timed("registry compute_all_tiers", compute_all_tiers(database, current_block=2))
+    finally:
+        await cleanup(database)
+        await database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
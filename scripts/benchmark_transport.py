@@ -0,0 +1,95 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Compares the TCP/HTTP transport against the unix socket + shared memory transport of the model server.
+
+Start two model servers that answer with a fixed payload instead of rendering, so the numbers measure the
+transport rather than the GPU, e.g.
+
+    python model/server.py --port 5005 --stub_payload_size 2097152
+    python model/server.py --uds /tmp/fractal-model.sock --stub_payload_size 2097152
+
+and run
+
+    python scripts/benchmark_transport.py --http http://127.0.0.1:5005 --unix unix:///tmp/fractal-model.sock
+
+Every request uses the same prompt and seed so both transports move the same video. Reported are the client
+side latency percentiles and the client CPU time per request; pass --server_pids to also sample the CPU time
+the model servers spent (read from /proc, Linux only).
+"""
+
+import os
+import time
+import asyncio
+import argparse
+
+from fractal.base.client import HttpClient
+
+
+def process_cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat, counted after the command name.
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    return (int(fields[11]) + int(fields[12])) / clock_ticks
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def run(endpoint: str, requests: int, warmup: int, server_pid: int = None):
+    client = HttpClient(endpoint)
+    prompt, seed = "a corgi running on the beach at sunset", 1234
+
+    for _ in range(warmup):
+        await client.generate(prompt, seed)
+
+    latencies = []
+    cpu_start = time.process_time()
+    server_cpu_start = process_cpu_seconds(server_pid) if server_pid else None
+    for _ in range(requests):
+        start = time.perf_counter()
+        completion = await client.generate(prompt, seed)
+        latencies.append(time.perf_counter() - start)
+    cpu = time.process_time() - cpu_start
+    server_cpu = process_cpu_seconds(server_pid) - server_cpu_start if server_pid else None
+    await client.close_session()
+
+    print(f"{endpoint}")
+    print(f"  completion size:     {len(completion)} chars")
+    print(f"  latency p50/p95/max: {percentile(latencies, 50) * 1000:.2f} / {percentile(latencies, 95) * 1000:.2f} / {max(latencies) * 1000:.2f} ms")
+    print(f"  client cpu/request:  {cpu / requests * 1000:.2f} ms")
+    if server_cpu is not None:
+        print(f"  server cpu/request:  {server_cpu / requests * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--http", type=str, default="http://127.0.0.1:5005")
+    parser.add_argument("--unix", type=str, default="unix:///tmp/fractal-model.sock")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--server_pids", type=int, nargs=2, default=None, help="PIDs of the http and unix model servers.")
+    args = parser.parse_args()
+
+    http_pid, unix_pid = args.server_pids or (None, None)
+    asyncio.run(run(args.http, args.requests, args.warmup, http_pid))
+    asyncio.run(run(args.unix, args.requests, args.warmup, unix_pid))
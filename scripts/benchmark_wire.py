@@ -0,0 +1,98 @@
+# The MIT License (MIT)
+# Copyright © 2024 Manifold Labs
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Compares the two ways a video crosses the axon/dendrite link: base64 inside a JSON synapse body (Challenge)
+and raw bytes streamed in chunks (StreamingChallenge, Inference).
+
+    python scripts/benchmark_wire.py --size_mb 2 --requests 50
+
+Both sides of a request are run in this process on a random payload of the given size, doing the work the
+prover and the verifier do per request:
+
+- json: the prover puts the base64 completion in a JSON body, the verifier parses it and hashes the completion.
+- raw: the prover decodes its base64 completion chunk by chunk onto the wire, the verifier re-encodes every
+  chunk and checks its digest and the running hash.
+
+Reported are the bytes on the wire (payload only, headers are the same for both) and the CPU time per request.
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import argparse
+
+# Mirrors fractal.protocol.STREAM_CHUNK_BYTES, kept here so the script runs without bittensor installed.
+STREAM_CHUNK_BYTES = 49152
+
+
+def json_round_trip(completion: str) -> int:
+    body = json.dumps({"completion": completion}).encode("utf-8")
+    received = json.loads(body)["completion"]
+    hashlib.sha256(received.encode("utf-8")).hexdigest()
+    return len(body)
+
+
+def raw_round_trip(completion: str, chunk_digests) -> int:
+    chunk_chars = STREAM_CHUNK_BYTES // 3 * 4
+    hasher = hashlib.sha256()
+    wire = 0
+    for index, start in enumerate(range(0, len(completion), chunk_chars)):
+        chunk = base64.b64decode(completion[start:start + chunk_chars])
+        wire += len(chunk)
+        encoded = base64.b64encode(memoryview(chunk))
+        assert hashlib.sha256(encoded).hexdigest() == chunk_digests[index]
+        hasher.update(encoded)
+    hasher.hexdigest()
+    return wire
+
+
+def measure(name, round_trip, requests):
+    wire = round_trip()
+    start = time.process_time()
+    for _ in range(requests):
+        round_trip()
+    cpu = time.process_time() - start
+    print(f"{name}")
+    print(f"  bytes on the wire:   {wire}")
+    print(f"  cpu/request:         {cpu / requests * 1000:.2f} ms")
+    return wire
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size_mb", type=float, default=2.0, help="Size of the video payload in MB.")
+    parser.add_argument("--requests", type=int, default=50, help="Number of measured round trips per encoding.")
+    args = parser.parse_args()
+
+    video = os.urandom(int(args.size_mb * 1024 * 1024))
+    completion = base64.b64encode(video).decode("ascii")
+    chunk_chars = STREAM_CHUNK_BYTES // 3 * 4
+    chunk_digests = [
+        hashlib.sha256(completion[start:start + chunk_chars].encode("ascii")).hexdigest()
+        for start in range(0, len(completion), chunk_chars)
+    ]
+
+    json_wire = measure("json + base64", lambda: json_round_trip(completion), args.requests)
+    raw_wire = measure("raw chunks", lambda: raw_round_trip(completion, chunk_digests), args.requests)
+    print(f"raw chunks move {100 * (1 - raw_wire / json_wire):.1f}% fewer bytes")
+
+
+if __name__ == "__main__":
+    main()
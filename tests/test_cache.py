@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from fractal.prover.cache import CompletionCache
+from fractal.prover.scheduler import StakeScheduler, ProverBusyError
+
+
+async def until(condition):
+    while not condition():
+        await asyncio.sleep(0)
+
+
+def test_coalesces_with_highest_stake_and_longest_budget():
+    async def test():
+        cache = CompletionCache(max_bytes=1024, ttl=60)
+        release = asyncio.Event()
+        calls = []
+
+        async def generate(waiters):
+            calls.append(waiters)
+            await release.wait()
+            return "completion"
+
+        first = asyncio.ensure_future(cache.get_or_generate("key", generate, stake=1.0, budget=5.0))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_generate("key", generate, stake=50.0, budget=10.0))
+        await asyncio.sleep(0)
+
+        waiters = calls[0]
+        assert waiters.stake == 50.0
+        assert waiters.budget() > 5.0
+        assert waiters.changed.is_set()
+
+        release.set()
+        assert await asyncio.gather(first, second) == ["completion", "completion"]
+        assert len(calls) == 1
+        assert cache.coalesced == 1
+        assert await cache.get_or_generate("key", generate) == "completion"
+        assert cache.hits == 1
+
+    asyncio.run(test())
+
+
+def test_busy_and_cancelled_outcomes_are_not_shared():
+    async def test():
+        cache = CompletionCache(max_bytes=1024, ttl=60)
+        release = asyncio.Event()
+        calls = []
+
+        async def generate(waiters):
+            calls.append(waiters)
+            await release.wait()
+            if len(calls) == 1:
+                raise ProverBusyError("busy")
+            return "completion"
+
+        first = asyncio.ensure_future(cache.get_or_generate("key", generate, stake=1.0, budget=5.0))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_generate("key", generate, stake=1.0, budget=5.0))
+        await asyncio.sleep(0)
+        release.set()
+
+        with pytest.raises(ProverBusyError):
+            await first
+        assert await second == "completion"
+        assert len(calls) == 2
+
+        cache.discard("key")
+        calls.clear()
+        release.clear()
+        first = asyncio.ensure_future(cache.get_or_generate("key", generate, stake=1.0, budget=5.0))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_generate("key", generate, stake=1.0, budget=5.0))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await second == "completion"
+        assert len(calls) == 2
+
+    asyncio.run(test())
+
+
+def test_failures_are_shared_but_not_kept():
+    async def test():
+        cache = CompletionCache(max_bytes=1024, ttl=60)
+        release = asyncio.Event()
+        calls = []
+
+        async def generate(waiters):
+            calls.append(waiters)
+            await release.wait()
+            if len(calls) == 1:
+                raise RuntimeError("model failed")
+            return "completion"
+
+        first = asyncio.ensure_future(cache.get_or_generate("key", generate))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_generate("key", generate))
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(first, second, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert not cache.inflight
+
+        assert await cache.get_or_generate("key", generate) == "completion"
+        assert len(calls) == 2
+
+    asyncio.run(test())
+
+
+def test_scheduler_requeues_when_a_waiter_raises_the_stake():
+    async def test():
+        scheduler = StakeScheduler(max_concurrency=1, max_queue=1, aging=0.0)
+        cache = CompletionCache(max_bytes=1024, ttl=60)
+        await scheduler.acquire(1.0)
+
+        async def generate(waiters):
+            async with scheduler.slot(waiters=waiters):
+                return "completion"
+
+        first = asyncio.ensure_future(cache.get_or_generate("key", generate, stake=1.0, budget=5.0))
+        await asyncio.wait_for(until(lambda: scheduler.queue), 1)
+        low = scheduler.queue[0][0]
+        second = asyncio.ensure_future(cache.get_or_generate("key", generate, stake=100.0, budget=5.0))
+        await asyncio.wait_for(until(lambda: scheduler.queue and scheduler.queue[0][0] < low), 1)
+        assert len(scheduler.queue) == 1
+
+        scheduler.release()
+        assert await asyncio.gather(first, second) == ["completion", "completion"]
+        assert scheduler.in_flight == 0
+
+    asyncio.run(test())
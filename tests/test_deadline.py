@@ -0,0 +1,169 @@
+import time
+import base64
+import socket
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+bt = pytest.importorskip("bittensor")
+pytest.importorskip("loguru")
+pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+pytest.importorskip("fastapi")
+uvicorn = pytest.importorskip("uvicorn")
+
+from model import server
+from fractal.base.client import HttpClient, CircuitBreaker, ModelDeadlineError
+from fractal.prover.cache import CompletionCache
+from fractal.utils.generation import GenerationQueue, DeadlineExceeded, error_status
+
+RENDER_TIME = 0.3
+VIDEO = b"video"
+
+
+def render(seed, text, profile="default"):
+    time.sleep(RENDER_TIME)
+    return VIDEO
+
+
+class RecordingQueue(GenerationQueue):
+    """Keeps the (seed, text, budget, profile) of every request the model server queued."""
+
+    def __init__(self, render):
+        super().__init__(render)
+        self.received = []
+
+    def submit(self, seed, text, budget=None, profile="default"):
+        self.received.append((seed, text, budget, profile))
+        return super().submit(seed, text, budget, profile)
+
+
+@pytest.fixture
+def with_server(monkeypatch):
+    """Runs model/server.py's app on a free port with `render` stubbed out, and a client pointed at it."""
+    monkeypatch.setattr(server, "render", render)
+    monkeypatch.setattr(server, "GenerationQueue", RecordingQueue)
+
+    async def run(test):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        uvicorn_server = uvicorn.Server(uvicorn.Config(server.app, log_level="warning"))
+        serving = asyncio.get_running_loop().create_task(uvicorn_server.serve(sockets=[sock]))
+        while not uvicorn_server.started:
+            await asyncio.sleep(0.01)
+        client = HttpClient(f"http://127.0.0.1:{port}", health_interval=0)
+        try:
+            return await test(client, server.generation_queue)
+        finally:
+            await client.close_session()
+            uvicorn_server.should_exit = True
+            await serving
+            sock.close()
+
+    return lambda test: asyncio.run(run(test))
+
+
+def test_generate_forwards_budget(with_server):
+    async def test(client, queue):
+        completion = await client.generate("a cat", 1, budget=5)
+        assert base64.b64decode(completion) == VIDEO
+        assert 0 < queue.received[0][2] <= 5
+
+    with_server(test)
+
+
+def test_prover_forwards_remaining_budget(with_server):
+    prover = pytest.importorskip("fractal.base.prover")
+
+    class Neuron:
+        remaining_budget = prover.BaseProverNeuron.remaining_budget
+        time_since_sent = prover.BaseProverNeuron.time_since_sent
+
+        class config:
+            class neuron:
+                deadline_margin = 1.0
+
+    # The verifier sent the request two seconds ago with a ten second timeout.
+    synapse = bt.Synapse(timeout=10.0)
+    synapse.dendrite.nonce = time.time_ns() - 2 * 10**9
+
+    async def test(client, queue):
+        budget = Neuron().remaining_budget(synapse)
+        assert 6.5 < budget <= 7
+        cache = CompletionCache(max_bytes=1024, ttl=60)
+        await cache.get_or_generate(
+            ("a cat", 1), lambda waiters: client.generate("a cat", 1, budget=waiters.budget()), budget=budget
+        )
+        assert 6 < queue.received[0][2] <= budget
+
+    with_server(test)
+
+
+def test_queue_drops_expired_request(with_server):
+    async def test(client, queue):
+        queue.service_time = RENDER_TIME
+        future = queue.submit(1, "a cat", budget=RENDER_TIME / 2)
+        with pytest.raises(DeadlineExceeded) as info:
+            await future
+        assert error_status(info.value)[0] == 408
+        assert queue.dropped == 1
+
+    with_server(test)
+
+
+def test_client_raises_deadline_error_on_408(with_server):
+    async def test(client, queue):
+        # One render teaches the queue how long renders take; a budget below that cannot be met.
+        await client.generate("a cat", 1, budget=5)
+        with pytest.raises(ModelDeadlineError) as info:
+            await client.generate("a dog", 2, budget=RENDER_TIME / 2)
+        assert "Deadline exceeded" in str(info.value)
+        assert queue.dropped == 1
+        assert len(queue.received) == 2
+
+    with_server(test)
+
+
+def test_batch_drops_jobs_that_cannot_make_the_budget(with_server):
+    async def test(client, queue):
+        jobs = [("a cat", 1), ("a dog", 2), ("a cow", 3)]
+        # The first render teaches the queue how long renders take; the others cannot finish in what is left.
+        results = dict([result async for result in client.generate_many(jobs, budget=RENDER_TIME * 1.5)])
+        assert base64.b64decode(results[0]) == VIDEO
+        assert isinstance(results[1], ModelDeadlineError)
+        assert isinstance(results[2], ModelDeadlineError)
+        assert queue.dropped == 2
+        assert all(0 < budget <= RENDER_TIME * 1.5 for _, _, budget, _ in queue.received)
+
+    with_server(test)
+
+
+def test_batch_raises_deadline_error_when_budget_runs_out(with_server):
+    async def test(client, queue):
+        with pytest.raises(ModelDeadlineError):
+            async for _ in client.generate_many([("a cat", 1)], budget=RENDER_TIME / 2):
+                pass
+        assert client.endpoints[0].breaker.failures == 0
+
+    with_server(test)
+
+
+def test_cancelled_trial_request_reopens_circuit(with_server):
+    async def test(client, queue):
+        endpoint = client.endpoints[0]
+        endpoint.breaker.trip()
+        endpoint.breaker.opened_at -= endpoint.breaker.reset_timeout
+        task = asyncio.ensure_future(client.generate("a cat", 1))
+        await asyncio.sleep(RENDER_TIME / 2)
+        assert endpoint.breaker.state == CircuitBreaker.HALF_OPEN
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert endpoint.breaker.state == CircuitBreaker.OPEN
+        assert endpoint.breaker.available()
+        await client.generate("a dog", 2)
+        assert endpoint.breaker.state == CircuitBreaker.CLOSED
+
+    with_server(test)
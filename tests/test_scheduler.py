@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from fractal.prover.scheduler import StakeScheduler, QueueFullError, QueueTimeoutError
+
+
+def test_admits_up_to_max_concurrency():
+    async def test():
+        scheduler = StakeScheduler(max_concurrency=2, max_queue=4, aging=0.0)
+        await scheduler.acquire(1.0)
+        await scheduler.acquire(1.0)
+        assert scheduler.in_flight == 2
+        with pytest.raises(QueueTimeoutError):
+            await scheduler.acquire(1.0, timeout=0.01)
+        assert scheduler.expired == 1
+        assert not scheduler.queue
+
+    asyncio.run(test())
+
+
+def test_rejects_without_queue_when_busy():
+    async def test():
+        scheduler = StakeScheduler(max_concurrency=1, max_queue=0, aging=0.0)
+        await scheduler.acquire(1.0)
+        with pytest.raises(QueueFullError):
+            await scheduler.acquire(1000.0, timeout=1.0)
+        assert scheduler.rejected == 1
+        scheduler.release()
+        await scheduler.acquire(1.0)
+        assert scheduler.in_flight == 1
+
+    asyncio.run(test())
+
+
+def test_higher_stake_displaces_lowest_waiter():
+    async def test():
+        scheduler = StakeScheduler(max_concurrency=1, max_queue=1, aging=0.0)
+        await scheduler.acquire(1.0)
+        low = asyncio.ensure_future(scheduler.acquire(1.0))
+        await asyncio.sleep(0)
+        high = asyncio.ensure_future(scheduler.acquire(100.0))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await low
+        assert scheduler.evicted == 1
+
+        scheduler.release()
+        await high
+        assert scheduler.in_flight == 1
+        assert not scheduler.queue
+
+    asyncio.run(test())
+
+
+def test_waiters_run_in_stake_order():
+    async def test():
+        scheduler = StakeScheduler(max_concurrency=1, max_queue=4, aging=0.0)
+        await scheduler.acquire(1.0)
+        order = []
+
+        async def request(stake):
+            async with scheduler.slot(stake):
+                order.append(stake)
+
+        tasks = [asyncio.ensure_future(request(stake)) for stake in (1.0, 50.0, 10.0)]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        assert order == [50.0, 10.0, 1.0]
+
+    asyncio.run(test())